@@ -1,4 +1,5 @@
-from .lib import menu
+import sublime
+from .lib import capabilities, localstatus, menu, status, thread, wcdb
 from package_control import events
 
 HYPNOTOADSVN_PKGNAME = "HypnotoadSVN"
@@ -7,9 +8,17 @@ HYPNOTOADSVN_PKGNAME = "HypnotoadSVN"
 def plugin_loaded():
     """Handles the plugin loaded event"""
     menu.create_user_side_bar()
+    # the svn binary is probed before the first command needs its options
+    sublime.set_timeout_async(capabilities.get, 0)
 
 
 def plugin_unloaded():
     """Handles the plugin unloaded event"""
+    # the threads, watches and connections would otherwise be left behind by every reload
+    status.stop()
+    thread.terminate_all()
+    thread.Loop.stop()
+    wcdb.Database.close()
+    localstatus.Records.forget()
     if events.remove(HYPNOTOADSVN_PKGNAME) is not False:
         menu.remove_user_side_bar()
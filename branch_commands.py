@@ -97,15 +97,15 @@ class HypnoSvnMergeCommand(svn_commands.HypnoSvnCommand):
         params = []
         for a in args:
             if re.match(CHERRYPICK_FORMAT, a):
-                params.append('-c ' + a)
+                params.extend(['-c', a])
             elif re.match(REVISIONS_FORMAT, a):
-                params.append('-r ' + a)
+                params.extend(['-r', a])
             elif (a != ''):
                 argserr.append(a)
         if len(argserr) != 0:
             sublime.error_message('These revisions argument are not in a valid format:\n ' + '\n '.join(argserr))
             return
-        self.run_command('merge ' + ' '.join(params), [self.branch, self.files[0]])
+        self.run_command(['merge'] + params, [self.branch, self.files[0]])
 
     def pick_revisions(self):
         """Prompts the user for revision numbers"""
@@ -161,7 +161,7 @@ class HypnoSvnMergeReintegrateCommand(HypnoSvnMergeCommand):
     
     def on_branch_picked(self, value):
         """Handles picking the branch"""
-        self.run_command('merge --reintegrate', [value, self.files[0]])
+        self.run_command(['merge', '--reintegrate'], [value, self.files[0]])
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -192,7 +192,7 @@ class HypnoSvnSwitchCommand(svn_commands.HypnoSvnCommand):
 
     def on_branch_picked(self, value):
         """Handles selecting a value"""
-        self.run_command('switch', [value, self.files[0]])
+        self.run_command(['switch'], [value, self.files[0]])
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -224,7 +224,7 @@ class HypnoSvnSwitchIgnoreAncestryCommand(svn_commands.HypnoSvnCommand):
 
     def on_branch_picked(self, value):
         """Handles selecting a value"""
-        self.run_command('switch --ignore-ancestry ', [value, self.files[0]])
+        self.run_command(['switch', '--ignore-ancestry'], [value, self.files[0]])
 
 
     def run(self, paths=None, group=-1, index=-1):
@@ -251,10 +251,6 @@ class HypnoSvnBranchCommand(svn_commands.HypnoSvnCommand):
         self.url = None
         self.branch = None
 
-    def escape(self, message):
-        """Escapes quotes in a commit message."""
-        return message.replace('"', '\\"')
-
     def on_complete(self, proc):
         """If the branch was successfully created, add it to the list of project branches"""
         if proc.returncode != 0:
@@ -270,7 +266,7 @@ class HypnoSvnBranchCommand(svn_commands.HypnoSvnCommand):
             sublime.status_message('Commit message too short')
             return
         items = [self.url, self.branch]
-        self.run_command('copy -m "' + self.escape(self.message) + '"', items, on_complete=self.on_complete)
+        self.run_command(['copy', '-m', self.message], items, on_complete=self.on_complete)
 
     def on_done_input(self, value):
         """Handles completion of an input panel"""
@@ -0,0 +1,462 @@
+import re
+import tempfile
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from . import capabilities, command, info, settings, status, thread, util
+
+try:
+    import pysvn
+except ImportError:
+    pysvn = None
+
+OUTPUT_TAIL = 200
+LOG_PARSE = r'-{72}[\r\n]+r(\d+) \| ([^|]+) \| ([^|]+) \| [^\n\r]+[\n\r]+(.+)'
+LOG_DATE_PARSE = r'(\d{4}-\d\d-\d\d)T(\d\d:\d\d:\d\d)'
+STATUS_PARSE = r'(^[A-W\?\!\ >]+?) +(\+ +)?(.*)'
+REVISION_PARSE = r'(?:revision|Committed revision) (\d+)\.'
+LOG_SEPARATOR = '-' * 72
+ITEM_CODES = {
+    'added': 'A',
+    'conflicted': 'C',
+    'deleted': 'D',
+    'external': 'X',
+    'ignored': 'I',
+    'incomplete': '!',
+    'missing': '!',
+    'modified': 'M',
+    'obstructed': '~',
+    'replaced': 'R',
+    'unversioned': '?'
+}
+CODE_ITEMS = dict((code, item) for item, code in ITEM_CODES.items() if item != 'incomplete')
+NOTIFY_CODES = {
+    'update_add': 'A',
+    'update_delete': 'D',
+    'update_update': 'U',
+    'update_external': 'X',
+    'tree_conflict': 'C'
+}
+
+
+def parse_log_xml(raw):
+    """Parses the output of `svn log --xml` into the (revision, author, date, message) of each revision"""
+    try:
+        tree = ElementTree.fromstring(raw.strip())
+    except ElementTree.ParseError as e:
+        util.debug('Unable to parse log: ' + str(e))
+        return []
+    logs = []
+    for entry in tree.iter('logentry'):
+        author = entry.findtext('author') or ''
+        date = re.match(LOG_DATE_PARSE, entry.findtext('date') or '')
+        message = (entry.findtext('msg') or '').strip().split('\n')[0]
+        logs.append((entry.get('revision'), author, ' '.join(date.groups()) if date else '', message))
+    return logs
+
+
+def parse_log(raw):
+    """Parses the output of `svn log`, with or without --xml"""
+    if not raw:
+        return []
+    if raw.lstrip().startswith('<?xml'):
+        return parse_log_xml(raw)
+    return re.findall(LOG_PARSE, raw, re.M)
+
+
+def parse_status_text(raw):
+    """Parses the output of a plain `svn status` into index entries, for clients without --xml"""
+    entries = {}
+    for change, modifier, path in re.findall(STATUS_PARSE, raw or '', re.M):
+        entries[status.normalize(path)] = {
+            'path': path,
+            'item': CODE_ITEMS.get(change[0], 'normal'),
+            'props': 'modified' if len(change) > 1 and change[1] == 'M' else 'none',
+            'revision': None,
+            'tree-conflicted': len(change) > 6 and change[6] == 'C',
+            'locked': len(change) > 5 and change[5] == 'K',
+            'kind': None
+        }
+    return entries
+
+
+def parse_status(raw):
+    """Parses the output of `svn status`, with or without --xml"""
+    if raw and raw.lstrip().startswith('<?xml'):
+        return status.parse_status(raw)
+    return parse_status_text(raw)
+
+
+def parse_revision(raw):
+    """Finds the revision an update or a commit ended at"""
+    found = re.findall(REVISION_PARSE, raw or '')
+    return int(found[-1]) if found else None
+
+
+def status_line(entry):
+    """Formats an index entry the way `svn status` prints it"""
+    code = ITEM_CODES.get(entry['item'], ' ')
+    props = {'modified': 'M', 'conflicted': 'C'}.get(entry['props'], ' ')
+    return code + props + '   ' + ('K' if entry.get('locked') else ' ') + ('C' if entry['tree-conflicted'] else ' ') + ' ' + entry['path']
+
+
+class Backend:
+    """The Subversion operations used by the commands, every one returns a Process whose result is set once it completes"""
+    name = None
+
+    def info(self, name, paths, log=False, async=False, on_complete=None):
+        """Gets the url, revision, last changed revision and kind of the paths, keyed by normalized path"""
+        raise NotImplementedError
+
+    def status(self, name, paths, log=True, async=True, on_complete=None, depth='infinity', ignore_externals=False, structured=False):
+        """Gets the changes below the paths as index entries keyed by normalized path, structured if nobody reads the output"""
+        raise NotImplementedError
+
+    def log(self, name, paths, log=True, async=True, on_complete=None, limit=None, verbose=False, structured=False):
+        """Gets the (revision, author, date, message) of the latest revisions of the paths, structured if nobody reads the output"""
+        raise NotImplementedError
+
+    def diff(self, name, paths, log=True, async=True, on_complete=None, revision=None):
+        """Gets the differences of the paths, with the working copy or between the revisions of an 'a:b' range"""
+        raise NotImplementedError
+
+    def blame(self, name, paths, log=True, async=True, on_complete=None):
+        """Gets the revision and author of each line of the paths"""
+        raise NotImplementedError
+
+    def ls(self, name, paths, log=True, async=True, on_complete=None):
+        """Gets the names of the entries of repository directories"""
+        raise NotImplementedError
+
+    def cat(self, name, paths, log=True, async=True, on_complete=None, revision=None):
+        """Gets the contents of files, at a revision if given"""
+        raise NotImplementedError
+
+    def update(self, name, paths, log=True, async=True, on_complete=None, revision=None, ignore_externals=False):
+        """Updates the paths, to a revision if given, the result is the revision they are at"""
+        raise NotImplementedError
+
+    def commit(self, name, paths, log=True, async=True, on_complete=None, message=''):
+        """Commits the paths, the result is the committed revision"""
+        raise NotImplementedError
+
+
+class Cli(Backend):
+    """Runs every operation with the svn command line client"""
+    name = 'cli'
+
+    def run(self, name, args, paths, log=True, async=True, on_complete=None, parse=None, write=False):
+        """Starts svn with the arguments, on_complete gets the process once its result has been parsed"""
+        if parse is not None:
+            on_complete = partial(self.parsed, parse, on_complete)
+        roots = sorted(set(filter(None, (status.find_root(f) for f in paths or [] if not util.is_url(f)))))
+        # logged output is streamed to the output view, only the end of it is kept for the callbacks
+        return thread.Process(
+            name, command.svn(*args), paths, log, async, on_complete,
+            retain=not log, tail=OUTPUT_TAIL, priority=thread.USER, root=roots, write=write
+        )
+
+    def parsed(self, parse, on_complete, process):
+        """Sets the result of a process before handing it to on_complete"""
+        process.result = parse(process.output())
+        if on_complete is not None:
+            on_complete(process)
+
+    def info(self, name, paths, log=False, async=False, on_complete=None):
+        """Runs svn info"""
+        return self.run(name, ['info', '--xml'], paths, log, async, on_complete, info.parse_info)
+
+    def status(self, name, paths, log=True, async=True, on_complete=None, depth='infinity', ignore_externals=False, structured=False):
+        """Runs svn status, with --xml if the output is only parsed"""
+        args = ['status']
+        if structured and capabilities.supports('status', '--xml'):
+            args.append('--xml')
+        if depth != 'infinity':
+            args.extend(['--depth', depth] if capabilities.supports('status', '--depth') else ['--non-recursive'])
+        if ignore_externals:
+            args.append('--ignore-externals')
+        return self.run(name, args, paths, log, async, on_complete, parse_status)
+
+    def log(self, name, paths, log=True, async=True, on_complete=None, limit=None, verbose=False, structured=False):
+        """Runs svn log, from HEAD and with --xml if the output is only parsed"""
+        args = ['log']
+        if structured:
+            args.extend(['-r', 'HEAD:1'])
+            if capabilities.supports('log', '--xml'):
+                args.append('--xml')
+        if verbose:
+            args.append('-v')
+        if limit:
+            args.extend(['-l', str(limit)])
+        return self.run(name, args, paths, log, async, on_complete, parse_log)
+
+    def diff(self, name, paths, log=True, async=True, on_complete=None, revision=None):
+        """Runs svn diff"""
+        return self.run(name, ['diff'] + (['-r', revision] if revision else []), paths, log, async, on_complete)
+
+    def blame(self, name, paths, log=True, async=True, on_complete=None):
+        """Runs svn blame"""
+        return self.run(name, ['blame'], paths, log, async, on_complete)
+
+    def ls(self, name, paths, log=True, async=True, on_complete=None):
+        """Runs svn ls"""
+        return self.run(name, ['ls'], paths, log, async, on_complete, lambda raw: (raw or '').splitlines())
+
+    def cat(self, name, paths, log=True, async=True, on_complete=None, revision=None):
+        """Runs svn cat"""
+        return self.run(name, ['cat'] + (['-r', revision] if revision else []), paths, log, async, on_complete)
+
+    def update(self, name, paths, log=True, async=True, on_complete=None, revision=None, ignore_externals=False):
+        """Runs svn update"""
+        args = ['update'] + (['-r', str(revision)] if revision else []) + (['--ignore-externals'] if ignore_externals else [])
+        return self.run(name, args, paths, log, async, on_complete, parse_revision, write=True)
+
+    def commit(self, name, paths, log=True, async=True, on_complete=None, message=''):
+        """Runs svn commit"""
+        return self.run(name, ['commit', '-m', message], paths, log, async, on_complete, parse_revision, write=True)
+
+
+class Task(thread.Process):
+    """An operation run inside Sublime Text by the bindings, scheduled and reported like a process"""
+
+    def __init__(self, name, operation, work, paths=None, log=True, async=False, on_complete=None, write=False, options=None):
+        """Initializes a Task, work gets the task and returns its result"""
+        self.work = work
+        self.result = None
+        roots = sorted(set(filter(None, (status.find_root(f) for f in paths or [] if not util.is_url(f)))))
+        # the options are part of the command, so only identical requests are coalesced
+        args = ['pysvn', operation] + ['--%s=%s' % option for option in sorted((options or {}).items())]
+        # interactive: a call in this process is only cancelled between its steps, so it gets no timeout
+        super().__init__(
+            name, args, paths, log, async, on_complete, interactive=True,
+            retain=not log, tail=OUTPUT_TAIL, priority=thread.USER, root=roots, write=write
+        )
+
+    def build(self, cmd, paths, interactive):
+        """Gets the operation, its options and its paths, which only identify the task since nothing is executed"""
+        return list(cmd) + list(paths or []), None
+
+    def start(self):
+        """Runs the work on one of the bindings workers"""
+        if self.cancelled:
+            self.complete()
+            return
+        self.begin()
+        Bindings.pool().submit(self.run)
+
+    def kill(self):
+        """Asks the running call to stop, the task completes once it has returned"""
+        self.cancelled = True
+
+    def run(self):
+        """Runs the work and completes the task"""
+        try:
+            self.result = self.work(self)
+            self.returncode = 0
+        except Exception as e:
+            self.add_line(thread.STDERR, str(e).strip() + '\n')
+            self.returncode = 1
+        self.finish()
+
+    def emit(self, text):
+        """Adds lines of output to the task"""
+        for line in text.splitlines():
+            self.add_line(thread.STDOUT, line + '\n')
+
+
+class Bindings(Backend):
+    """Runs the operations in-process with pysvn, keeping one client per worker between calls"""
+    name = 'bindings'
+    workers = None
+    local = threading.local()
+    lock = threading.Lock()
+
+    def pool():
+        """Gets the workers the tasks run on"""
+        with Bindings.lock:
+            if Bindings.workers is None:
+                Bindings.workers = ThreadPoolExecutor(max_workers=max(1, settings.get('parallelCommands', default=thread.DEFAULT_PARALLEL)))
+            return Bindings.workers
+
+    def client(self, task=None):
+        """Gets the client of the current worker, its context and sessions are reused by the next calls"""
+        client = getattr(Bindings.local, 'client', None)
+        if client is None:
+            client = pysvn.Client()
+            # like --non-interactive: only cached credentials and trusted certificates are used
+            client.callback_get_login = lambda realm, username, may_save: (False, '', '', False)
+            client.callback_ssl_server_trust_prompt = lambda trust: (False, 0, False)
+            Bindings.local.client = client
+        client.callback_notify = partial(self.notify, task) if task is not None else None
+        client.callback_cancel = (lambda: task.cancelled) if task is not None else None
+        return client
+
+    def notify(self, task, event):
+        """Writes the progress of an update the way svn prints it"""
+        action = str(event.get('action'))
+        if action == 'update_completed':
+            task.emit('Updated to revision %s.' % event['revision'].number)
+        elif action in NOTIFY_CODES:
+            task.emit(NOTIFY_CODES[action] + '    ' + event['path'])
+
+    def revision(self, number=None, kind=None):
+        """Gets a pysvn revision, by number or kind"""
+        if number is not None and str(number).upper() != 'HEAD':
+            return pysvn.Revision(pysvn.opt_revision_kind.number, int(number))
+        return pysvn.Revision(getattr(pysvn.opt_revision_kind, kind or 'head'))
+
+    def task(self, name, operation, work, paths, log, async, on_complete, write=False, **options):
+        """Starts a task for a piece of work on the paths"""
+        return Task(name, operation, partial(work, paths or []), paths, log, async, on_complete, write, options)
+
+    def info(self, name, paths, log=False, async=False, on_complete=None):
+        """Reads the info of the paths"""
+        def work(paths, task):
+            infos = {}
+            for path in paths:
+                for found, details in self.client(task).info2(path, recurse=False):
+                    kind = str(details['kind'])
+                    infos[status.normalize(path)] = {
+                        'url': details['URL'],
+                        'revision': details['rev'].number,
+                        'last_changed_rev': details['last_changed_rev'].number,
+                        'kind': 'dir' if kind == 'dir' else kind
+                    }
+            return infos
+        return self.task(name, 'info', work, paths, log, async, on_complete)
+
+    def status(self, name, paths, log=True, async=True, on_complete=None, depth='infinity', ignore_externals=False, structured=False):
+        """Reads the status of the paths"""
+        def work(paths, task):
+            entries = {}
+            recurse = depth == 'infinity'
+            for path in paths:
+                for found in self.client(task).status(path, recurse=recurse, get_all=False, ignore_externals=ignore_externals):
+                    entry = {
+                        'path': found.path,
+                        'item': str(found.text_status),
+                        'props': str(found.prop_status),
+                        'revision': found.entry.revision.number if found.entry is not None else None,
+                        'tree-conflicted': bool(getattr(found, 'tree_conflict', None)),
+                        'locked': bool(found.is_locked),
+                        'kind': str(found.entry.kind) if found.entry is not None else None
+                    }
+                    entries[status.normalize(found.path)] = entry
+                    if status.is_entry_changed(entry):
+                        task.emit(status_line(entry))
+            return entries
+        return self.task(
+            name, 'status', work, paths, log, async, on_complete,
+            depth=depth, ignore_externals=ignore_externals, structured=structured
+        )
+
+    def log(self, name, paths, log=True, async=True, on_complete=None, limit=None, verbose=False, structured=False):
+        """Reads the latest revisions of the paths"""
+        def work(paths, task):
+            logs = []
+            for path in paths:
+                for entry in self.client(task).log(path, discover_changed_paths=verbose, limit=limit or 0):
+                    date = time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(entry.date))
+                    message = entry.message or ''
+                    logs.append((str(entry.revision.number), entry.author or '', date, message.strip().split('\n')[0]))
+                    task.emit(LOG_SEPARATOR)
+                    task.emit('r%s | %s | %s | %d lines' % (entry.revision.number, entry.author, date, len(message.splitlines())))
+                    if verbose:
+                        task.emit('Changed paths:')
+                        for changed in entry.changed_paths:
+                            task.emit('   %s %s' % (changed.action, changed.path))
+                    task.emit('')
+                    task.emit(message)
+            if logs:
+                task.emit(LOG_SEPARATOR)
+            return logs
+        return self.task(name, 'log', work, paths, log, async, on_complete, limit=limit, verbose=verbose, structured=structured)
+
+    def diff(self, name, paths, log=True, async=True, on_complete=None, revision=None):
+        """Compares the paths with their base, or between the revisions of a range"""
+        def work(paths, task):
+            start, end = revision.split(':') if revision else (None, None)
+            text = ''
+            for path in paths:
+                text = text + self.client(task).diff(
+                    tempfile.gettempdir(), path,
+                    revision1=self.revision(start, 'base'), revision2=self.revision(end, 'working')
+                )
+            task.emit(text)
+            return text
+        return self.task(name, 'diff', work, paths, log, async, on_complete, revision=revision)
+
+    def blame(self, name, paths, log=True, async=True, on_complete=None):
+        """Reads who last changed each line of the paths"""
+        def work(paths, task):
+            lines = []
+            for path in paths:
+                for line in self.client(task).annotate(path):
+                    lines.append((line['revision'].number, line['author'], line['line']))
+                    task.emit('%6s %10s %s' % (line['revision'].number, line['author'], line['line']))
+            return lines
+        return self.task(name, 'blame', work, paths, log, async, on_complete)
+
+    def ls(self, name, paths, log=True, async=True, on_complete=None):
+        """Lists repository directories"""
+        def work(paths, task):
+            names = []
+            for path in paths:
+                for entry, lock in self.client(task).list(path, recurse=False)[1:]:
+                    found = entry.repos_path.rstrip('/').split('/')[-1]
+                    if entry.kind == pysvn.node_kind.dir:
+                        found = found + '/'
+                    names.append(found)
+                    task.emit(found)
+            return names
+        return self.task(name, 'ls', work, paths, log, async, on_complete)
+
+    def cat(self, name, paths, log=True, async=True, on_complete=None, revision=None):
+        """Reads the contents of files"""
+        def work(paths, task):
+            # like svn cat, a working copy file is read from its base and a URL from HEAD unless a revision is given
+            text = ''.join(
+                self.client(task).cat(path, self.revision(revision, 'head' if util.is_url(path) else 'base')).decode('utf-8', 'replace')
+                for path in paths
+            )
+            task.emit(text)
+            return text
+        return self.task(name, 'cat', work, paths, log, async, on_complete, revision=revision)
+
+    def update(self, name, paths, log=True, async=True, on_complete=None, revision=None, ignore_externals=False):
+        """Updates the paths"""
+        def work(paths, task):
+            found = self.client(task).update(paths, revision=self.revision(revision), ignore_externals=ignore_externals)
+            return found[-1].number if found else None
+        return self.task(name, 'update', work, paths, log, async, on_complete, True, revision=revision, ignore_externals=ignore_externals)
+
+    def commit(self, name, paths, log=True, async=True, on_complete=None, message=''):
+        """Commits the paths"""
+        def work(paths, task):
+            found = self.client(task).checkin(paths, message)
+            number = found.get('revision') if isinstance(found, dict) else found
+            number = getattr(number, 'number', None)
+            if number is not None:
+                task.emit('Committed revision %s.' % number)
+            return number
+        return self.task(name, 'commit', work, paths, log, async, on_complete, True, message=message)
+
+
+class Backends:
+    """Remembers the backend in use"""
+    current = None
+    lock = threading.Lock()
+
+
+def get():
+    """Gets the backend chosen in settings, the command line client if the bindings can not be imported"""
+    name = settings.get('svnBackend', default=Cli.name)
+    if name == Bindings.name and pysvn is None:
+        util.debug('pysvn can not be imported, using the svn command line client')
+        name = Cli.name
+    with Backends.lock:
+        if Backends.current is None or Backends.current.name != name:
+            Backends.current = Bindings() if name == Bindings.name else Cli()
+        return Backends.current
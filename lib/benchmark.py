@@ -0,0 +1,64 @@
+import time
+from . import capabilities, localstatus, output, status, util
+
+RUNS = 3
+
+
+def best_time(function, *args):
+    """Runs a function several times, returns its last result and its fastest time"""
+    best = None
+    result = None
+    for run in range(RUNS):
+        start = time.time()
+        result = function(*args)
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return result, best
+
+
+def cold_entries(root):
+    """Reads the status with the local engine, without the records cached by the previous scans"""
+    localstatus.Records.forget(root)
+    return status.local_entries(root)
+
+
+def changed_paths(entries):
+    """Gets the (item, path) of the changed entries, as `svn status` would list them"""
+    return set(
+        (entry['item'], status.normalize(entry['path']))
+        for entry in entries.values() if status.is_entry_changed(entry)
+    )
+
+
+def compare(root):
+    """Times the local status engine against svn status on a working copy, returns a summary row"""
+    local, local_time = best_time(cold_entries, root)
+    if local is None:
+        return '%s  skipped: the local status engine does not support this working copy' % root
+    cached, cached_time = best_time(status.local_entries, root)
+    cli, cli_time = best_time(status.cli_entries, root)
+    local_changes = changed_paths(local)
+    cli_changes = changed_paths(cli)
+    differences = len(local_changes ^ cli_changes)
+    for item, path in sorted(local_changes ^ cli_changes):
+        util.debug('Status benchmark: %s is %s in only one of the engines' % (path, item))
+    return '%s  %d entries, local %.3fs (%.3fs cached), svn %.3fs (%.1fx), %d changes, %d different' % (
+        root, len(local), local_time, cached_time, cli_time, cli_time / local_time if local_time > 0 else 0,
+        len(cli_changes), differences
+    )
+
+
+def run(files, window=None):
+    """Compares the local status engine with svn status on the working copies of the files"""
+    roots = []
+    for f in files:
+        root = status.find_root(f)
+        if root is not None and root not in roots:
+            roots.append(root)
+    if capabilities.version(True) is None:
+        rows = ['skipped: svn could not be run']
+    elif not roots:
+        rows = ['skipped: no working copy']
+    else:
+        rows = [compare(root) for root in roots]
+    output.add_summary('Status benchmark, best of %d runs' % RUNS, rows, window=window)
@@ -0,0 +1,173 @@
+import json
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from . import settings, snapshot, util
+
+VERSION = 1
+CACHE_FILE = 'capabilities.json'
+PROBE_TIMEOUT = 30
+# the subcommands whose options are probed
+SUBCOMMANDS = ['add', 'changelist', 'commit', 'delete', 'info', 'lock', 'log', 'resolve', 'revert', 'status', 'unlock', 'update']
+SECTION_PARSE = r'^(?!usage:)([a-z]+)( \([^)]*\))?: '
+OPTION_PARSE = r'--[a-z][a-z-]*'
+# what is assumed of a binary until it has been probed: no version and no optional options
+UNKNOWN = {
+    'mtime': None,
+    'version': None,
+    'options': {}
+}
+
+
+class Capabilities:
+    """Remembers the version and options of each svn binary, as long as the binary does not change"""
+    probed = {}
+    loaded = False
+    probing = {}
+    lock = threading.Lock()
+
+
+def cache_path():
+    """Gets the file where the probe results are stored"""
+    return os.path.join(snapshot.cache_folder(), CACHE_FILE)
+
+
+def binary(svn_path):
+    """Gets the full path of an svn binary, or the path as it was given if it can not be found"""
+    return shutil.which(svn_path) or svn_path
+
+
+def get_mtime(path):
+    """Gets the modification time of a binary, None if it can not be read"""
+    try:
+        return os.stat(path).st_mtime
+    except OSError:
+        return None
+
+
+def parse_version(raw):
+    """Parses the output of `svn --version --quiet` into a tuple of numbers"""
+    found = re.match(r'\s*(\d+)\.(\d+)(?:\.(\d+))?', raw or '')
+    if found is None:
+        return None
+    return tuple(int(number or 0) for number in found.groups())
+
+
+def parse_help(raw):
+    """Parses the output of `svn help` for several subcommands into their options"""
+    options = {}
+    current = None
+    for line in (raw or '').splitlines():
+        section = re.match(SECTION_PARSE, line)
+        if section is not None:
+            current = options.setdefault(section.group(1), [])
+        elif current is not None and line.lstrip().startswith('-'):
+            current.extend(re.findall(OPTION_PARSE, line.split(' : ', 1)[0]))
+    return options
+
+
+def run(args):
+    """Runs a probe command, returns its output or None if it fails"""
+    try:
+        raw = subprocess.check_output(args, stderr=subprocess.STDOUT, timeout=PROBE_TIMEOUT)
+    except (OSError, subprocess.SubprocessError) as e:
+        util.debug('svn probe failed: ' + str(e))
+        return None
+    return raw.decode('utf-8', 'replace')
+
+
+def probe(path, mtime):
+    """Asks an svn binary for its version and the options of the subcommands the plugin uses"""
+    start = time.time()
+    version = parse_version(run([path, '--version', '--quiet']))
+    if version is None:
+        return {
+            'mtime': mtime,
+            'version': None,
+            'options': {}
+        }
+    options = parse_help(run([path, 'help'] + SUBCOMMANDS))
+    util.debug('Probed svn %s at %s in %.3fs' % ('.'.join(str(n) for n in version), path, time.time() - start))
+    return {
+        'mtime': mtime,
+        'version': list(version),
+        'options': options
+    }
+
+
+def load():
+    """Reads the stored probe results"""
+    try:
+        with open(cache_path(), encoding='utf-8') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError):
+        return {}
+    if data.get('version') != VERSION:
+        return {}
+    return data.get('binaries', {})
+
+
+def save(binaries):
+    """Writes the probe results for the next sessions"""
+    path = cache_path()
+    try:
+        if not os.path.exists(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        probed = dict((key, found) for key, found in binaries.items() if found['version'] is not None)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION, 'binaries': probed}, f)
+        os.replace(path + '.tmp', path)
+    except (IOError, OSError) as e:
+        util.debug('Unable to save the svn probe: ' + str(e))
+
+
+def refresh(path, mtime, done):
+    """Probes an svn binary in the background and remembers what it supports"""
+    found = probe(path, mtime)
+    with Capabilities.lock:
+        Capabilities.probed[path] = found
+        Capabilities.probing.pop(path, None)
+        # failed probes are only remembered for this session, the binary may only be missing for now
+        if found['version'] is not None:
+            save(Capabilities.probed)
+    done.set()
+
+
+def get(wait=False):
+    """Gets the capabilities of the configured svn binary, probed once per modification of the binary, UNKNOWN while it is probed unless wait is set"""
+    path = binary(settings.get_svn_path().strip('"'))
+    mtime = get_mtime(path)
+    with Capabilities.lock:
+        if not Capabilities.loaded:
+            Capabilities.probed = load()
+            Capabilities.loaded = True
+        found = Capabilities.probed.get(path)
+        if found is not None and found['mtime'] == mtime:
+            return found
+        done = Capabilities.probing.get(path)
+        if done is None:
+            # the probe runs svn twice, which must not hold up the interface
+            done = threading.Event()
+            Capabilities.probing[path] = done
+            worker = threading.Thread(target=refresh, args=(path, mtime, done))
+            worker.daemon = True
+            worker.start()
+    if not wait:
+        return UNKNOWN
+    done.wait()
+    with Capabilities.lock:
+        return Capabilities.probed.get(path, UNKNOWN)
+
+
+def version(wait=False):
+    """Gets the version of the configured svn binary, None if it is unknown or still being probed unless wait is set"""
+    found = get(wait)
+    return tuple(found['version']) if found['version'] is not None else None
+
+
+def supports(subcommand, option):
+    """Checks if a subcommand of the configured svn binary accepts an option, False if the binary is not probed yet or could not be"""
+    return option in get()['options'].get(subcommand, [])
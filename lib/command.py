@@ -0,0 +1,94 @@
+import locale
+import os
+import shlex
+import subprocess
+import tempfile
+from . import capabilities, settings, util
+
+# above this many paths, svn reads them from a targets file instead of the argument list
+TARGETS_THRESHOLD = 100
+# svn subcommands, with their aliases, that change a working copy: they are serialised per working copy and never time out by default
+WRITE_SUBCOMMANDS = (
+    'add', 'changelist', 'cl', 'checkout', 'co', 'cleanup', 'commit', 'ci', 'copy', 'cp',
+    'delete', 'del', 'remove', 'rm', 'import', 'lock', 'merge', 'mkdir', 'move', 'mv', 'rename', 'ren',
+    'patch', 'propdel', 'pdel', 'pd', 'propedit', 'pedit', 'pe', 'propset', 'pset', 'ps',
+    'relocate', 'resolve', 'resolved', 'revert', 'switch', 'sw', 'unlock', 'update', 'up', 'upgrade'
+)
+
+
+def split(cmd):
+    """Splits a command line into an argument list, argument lists are returned as they are"""
+    if isinstance(cmd, (list, tuple)):
+        return list(cmd)
+    # posix rules would eat the backslashes of Windows paths
+    return shlex.split(cmd, posix=os.name != 'nt')
+
+
+def quote(args):
+    """Joins an argument list into a command line for display"""
+    if os.name == 'nt':
+        return subprocess.list2cmdline(args)
+    return ' '.join(shlex.quote(arg) for arg in args)
+
+
+def svn(*args):
+    """Gets the argument list of an svn command"""
+    return [settings.get_svn_path().strip('"')] + list(args)
+
+
+def is_svn(args):
+    """Checks if an argument list runs the configured svn binary"""
+    return len(args) > 0 and args[0] == settings.get_svn_path().strip('"')
+
+
+def subcommand(args):
+    """Gets the svn subcommand of an argument list"""
+    for arg in args[1:]:
+        if not arg.startswith('-'):
+            return arg
+    return None
+
+
+def write_targets(paths, encoding=None):
+    """Writes paths to a temporary targets file, returns its path"""
+    encoding = encoding or locale.getpreferredencoding(False)
+    with tempfile.NamedTemporaryFile('w', suffix='.targets', delete=False, encoding=encoding, errors='replace') as f:
+        f.write('\n'.join(paths) + '\n')
+        return f.name
+
+
+def remove_targets(targets):
+    """Removes a targets file"""
+    if targets is None:
+        return
+    try:
+        os.remove(targets)
+    except OSError:
+        pass
+
+
+def build(cmd, paths=None, interactive=True):
+    """Builds the argument list of a command and its paths, returns the arguments and the targets file to remove"""
+    args = split(cmd)
+    targets = None
+    if not interactive:
+        args.append('--non-interactive')
+    paths = paths or []
+    if len(paths) > TARGETS_THRESHOLD and is_svn(args) and capabilities.supports(subcommand(args), '--targets'):
+        targets = write_targets(paths)
+        args.extend(['--targets', targets])
+    else:
+        args.extend(paths)
+    return args, targets
+
+
+def tortoise(cmd, paths):
+    """Builds the argument list of a TortoiseProc command"""
+    parts = cmd.split(' ')
+    args = [settings.get_tortoise_path(), '/command:' + parts[0]] + parts[1:]
+    if len(paths) > TARGETS_THRESHOLD:
+        # TortoiseProc reads path files as UTF-16 and removes them itself
+        args.extend(['/pathfile:' + write_targets(paths, 'utf-16'), '/deletepathfile'])
+    else:
+        args.append('/path:' + util.tortoise_path(paths))
+    return args
@@ -0,0 +1,74 @@
+import os
+import threading
+import xml.etree.ElementTree as ElementTree
+from . import command, status, thread, util, wcdb
+
+
+class Externals:
+    """Remembers the directory externals found below each working copy root"""
+    found = {}
+    lock = threading.Lock()
+
+
+def cli_external_dirs(root):
+    """Finds the directory externals of a working copy with svn status"""
+    cmd = command.svn('status', '--xml', '--ignore-externals')
+    p = thread.Process('Externals', cmd, [root], False, False, root=root)
+    paths = []
+    try:
+        tree = ElementTree.fromstring((p.output() or '').strip())
+    except ElementTree.ParseError as e:
+        util.debug('Unable to parse status: ' + str(e))
+        return paths
+    for node in tree.iter('entry'):
+        wc_status = node.find('wc-status')
+        if wc_status is not None and wc_status.get('item') == 'external':
+            paths.append(os.path.abspath(node.get('path')))
+    return paths
+
+
+def discover(root):
+    """Gets the roots of the externals below a working copy, including nested externals, reading each definition once"""
+    stat = status.db_stat(root)
+    with Externals.lock:
+        known = Externals.found.get(root)
+    if known is not None and known[0] == stat:
+        return known[1]
+    paths = wcdb.external_dirs(root)
+    if paths is None:
+        paths = cli_external_dirs(root)
+    roots = []
+    for path in paths:
+        if os.path.isdir(os.path.join(path, status.ADMIN_DIR)):
+            roots.append(path)
+            roots.extend(discover(path))
+    with Externals.lock:
+        Externals.found[root] = (stat, roots)
+    util.debug('Found %d externals in %s' % (len(roots), root))
+    return roots
+
+
+def known(root):
+    """Gets the externals of a working copy that have already been discovered"""
+    with Externals.lock:
+        found = Externals.found.get(root)
+    return found[1] if found is not None else []
+
+
+def below(files, lookup=True):
+    """Gets the external roots below the files, only from earlier discoveries if lookup is false"""
+    found = []
+    for f in files:
+        root = status.find_root(f)
+        if root is None:
+            continue
+        parent = status.normalize(f)
+        for path in (discover(root) if lookup else known(root)):
+            if path not in found and status.is_child(status.normalize(path), parent):
+                found.append(path)
+    return found
+
+
+def expand(files, lookup=True):
+    """Adds the roots of the externals below the files to the files"""
+    return list(files) + below(files, lookup)
@@ -0,0 +1,107 @@
+import sublime
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from . import externals, output, settings, status, util
+
+DEFAULT_WORKERS = 4
+REVISION_PARSE = r'revision (\d+)\.$'
+ITEM_PARSE = r'^[A-Z?!~ ]{1,8} {2,}\S'
+
+
+def group(files):
+    """Groups files by working copy root, files outside of a working copy each get a group of their own"""
+    groups = OrderedDict()
+    for f in files:
+        root = status.find_root(f)
+        groups.setdefault(root or f, []).append(f)
+    return list(groups.items())
+
+
+def run_group(start, window, name, root, paths):
+    """Runs a command on a group of paths and writes its output as a single block"""
+    p = start(name, root, paths)
+    output.add_command_block(name, p.command, paths, p.interleaved(), p.returncode, window)
+    return p
+
+
+def describe(p):
+    """Summarizes the result of a process in a few words"""
+    lines = [line.strip('\r\n') for line in p.lines]
+    words = []
+    for line in reversed(lines):
+        found = re.search(REVISION_PARSE, line)
+        if found is not None:
+            words.append('r' + found.group(1))
+            break
+    items = len([line for line in lines if re.match(ITEM_PARSE, line)])
+    words.append('%d item%s' % (items, '' if items == 1 else 's'))
+    if p.returncode != 0 or p.error_count > 0:
+        first = p.errors[0].strip() if p.errors else ''
+        words.append('failed (%s)%s' % (p.returncode, ': ' + first if first else ''))
+    return ', '.join(words)
+
+
+def summarize(name, groups, processes, wall, window=None):
+    """Writes one summary of the groups, with the wall time next to the time they would have taken one after the other"""
+    width = max(len(root) for label, root, paths in groups)
+    rows = []
+    sequential = 0
+    for (label, root, paths), p in zip(groups, processes):
+        elapsed = p.finished_at - p.started_at if p.started_at is not None and p.finished_at is not None else 0
+        sequential = sequential + elapsed
+        rows.append('%s  %6.1fs  %s' % (root.ljust(width), elapsed, describe(p)))
+    failed = len([p for p in processes if p.returncode != 0 or p.error_count > 0])
+    footer = 'Wall time: %.1fs, sequential estimate: %.1fs' % (wall, sequential)
+    if wall > 0:
+        footer = footer + ' (%.1fx)' % (sequential / wall)
+    title = '%s summary: %d working copies, %d failed' % (name, len(groups), failed)
+    output.add_summary(title, rows, footer, window)
+
+
+def run_all(name, groups, start, on_complete, window=None):
+    """Runs the command groups on a bounded pool and summarizes them"""
+    began = time.time()
+    workers = max(1, settings.get('workingCopyWorkers', default=DEFAULT_WORKERS))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_group, start, window, label, root, paths) for label, root, paths in groups]
+        processes = [future.result() for future in futures]
+    wall = time.time() - began
+    util.debug('Ran %d working copies with %d workers in %.3fs' % (len(groups), workers, wall))
+    summarize(name, groups, processes, wall, window)
+    if on_complete is not None:
+        on_complete(processes)
+
+
+def fan_out(name, start, files, run_single, on_complete=None, split_externals=True):
+    """Calls start(name, root, paths) on each working copy root of the files, and on each external below them if split_externals, or run_single if there is only one"""
+    # without split_externals the command on a parent handles its externals, they are not run a second time
+    window = sublime.active_window()
+
+    def begin():
+        groups = []
+        found = group(files)
+        covered = set()
+        if not split_externals:
+            for root, paths in found:
+                covered.update(status.normalize(path) for path in externals.below(paths))
+        for root, paths in found:
+            if root in covered:
+                continue
+            covered.add(root)
+            groups.append((name + ' (' + root + ')', root, paths))
+            if not split_externals:
+                continue
+            for path in externals.below(paths):
+                if status.normalize(path) not in covered:
+                    covered.add(status.normalize(path))
+                    groups.append((name + ' (' + path + ')', path, [path]))
+        if len(groups) < 2:
+            sublime.set_timeout(run_single, 0)
+            return
+        run_all(name, groups, start, on_complete, window)
+    worker = threading.Thread(target=begin)
+    worker.daemon = True
+    worker.start()
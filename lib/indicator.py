@@ -0,0 +1,110 @@
+import sublime
+import threading
+import time
+from functools import partial
+from . import settings, status, util
+
+STATUS_KEY = 'hypnotoad_svn'
+DEFAULT_DELAY = 300
+LABELS = {
+    'added': 'Added',
+    'conflicted': 'Conflicted',
+    'deleted': 'Deleted',
+    'ignored': 'Ignored',
+    'incomplete': 'Incomplete',
+    'merged': 'Merged',
+    'missing': 'Missing',
+    'modified': 'Modified',
+    'normal': 'Unchanged',
+    'obstructed': 'Obstructed',
+    'replaced': 'Replaced',
+    'unversioned': 'Unversioned'
+}
+
+
+class Indicator:
+    """Collects the views waiting for their status bar to be refreshed"""
+    pending = {}
+    generation = 0
+    lock = threading.Lock()
+    events = 0
+    flushes = 0
+    queries = 0
+
+    def queue(view):
+        """Adds a view to the next refresh and restarts the debounce delay"""
+        with Indicator.lock:
+            Indicator.pending[view.id()] = view
+            Indicator.events = Indicator.events + 1
+            Indicator.generation = Indicator.generation + 1
+            generation = Indicator.generation
+        delay = settings.get('statusBarDelay', default=DEFAULT_DELAY)
+        sublime.set_timeout_async(partial(Indicator.flush, generation), delay)
+
+    def flush(generation):
+        """Refreshes the status bar of the queued views once the events have settled"""
+        with Indicator.lock:
+            if generation != Indicator.generation:
+                return
+            views = list(Indicator.pending.values())
+            Indicator.pending = {}
+        groups = {}
+        for view in views:
+            file_name = view.file_name()
+            root = status.find_root(file_name) if file_name else None
+            if root is None:
+                view.erase_status(STATUS_KEY)
+                continue
+            groups.setdefault(root, []).append((view, file_name))
+        Indicator.flushes = Indicator.flushes + 1
+        for root, files in groups.items():
+            Indicator.refresh(root, files)
+
+    def refresh(root, files):
+        """Runs at most one status query for a working copy and updates the status bar of its views"""
+        wc = status.WorkingCopy.indexes.get(root)
+        age = time.time() - wc.timestamp if wc is not None and wc.timestamp else None
+        queried = wc is None or wc.is_stale() or wc.is_dirty()
+        wc = status.WorkingCopy.get(root)
+        if wc is None:
+            return
+        if queried:
+            Indicator.queries = Indicator.queries + 1
+        for view, file_name in files:
+            text = describe(wc.entry(file_name))
+            if text is None:
+                view.erase_status(STATUS_KEY)
+            else:
+                view.set_status(STATUS_KEY, text)
+        util.debug('Status bar: %d views in %s, %s (index age: %s); %d events, %d flushes, %d queries so far' % (
+            len(files), root, 'queried' if queried else 'served from the index',
+            '%.1fs' % age if age is not None else 'not loaded',
+            Indicator.events, Indicator.flushes, Indicator.queries
+        ))
+
+
+def describe(entry):
+    """Gets the status bar text for an index entry, None if there is nothing to show"""
+    if entry is None:
+        return None
+    text = 'SVN: ' + LABELS.get(entry['item'], entry['item'])
+    if entry['props'] in status.CHANGED_PROPS:
+        text = text + ', properties ' + entry['props']
+    if entry['tree-conflicted']:
+        text = text + ', tree conflict'
+    if entry.get('locked'):
+        text = text + ', locked'
+    if entry['revision'] is not None:
+        text = text + ' (r' + str(entry['revision']) + ')'
+    return text
+
+
+def update(view, saved=False):
+    """Schedules a status bar refresh for a view, marking it as changed if it has just been saved"""
+    file_name = view.file_name()
+    if file_name is None:
+        return
+    if saved:
+        status.mark_dirty([file_name])
+    if settings.get('statusBar', default=True):
+        Indicator.queue(view)
@@ -0,0 +1,104 @@
+import xml.etree.ElementTree as ElementTree
+from . import capabilities, command, status, thread, util, wcdb
+
+# paths per `svn info` process, keeps the targets file and the output reasonably sized
+TARGETS_CHUNK_SIZE = 1000
+
+
+def parse_info(raw):
+    """Parses the output of `svn info --xml` into info dictionaries keyed by normalized path"""
+    infos = {}
+    if not raw:
+        return infos
+    try:
+        tree = ElementTree.fromstring(raw.strip())
+    except ElementTree.ParseError as e:
+        util.debug('Unable to parse info: ' + str(e))
+        return infos
+    for entry in tree.iter('entry'):
+        url = entry.find('url')
+        commit = entry.find('commit')
+        kind = entry.get('kind')
+        revision = entry.get('revision')
+        last_change = commit.get('revision') if commit is not None else None
+        infos[status.normalize(entry.get('path'))] = {
+            'url': url.text.strip() if url is not None and url.text else None,
+            'revision': int(revision) if revision is not None else None,
+            'last_changed_rev': int(last_change) if last_change is not None else None,
+            'kind': 'dir' if kind == 'directory' else kind
+        }
+    return infos
+
+
+def cli_infos(paths):
+    """Runs `svn info --xml` on the paths, one process per chunk, large chunks are passed with --targets"""
+    infos = {}
+    for start in range(0, len(paths), TARGETS_CHUNK_SIZE):
+        p = thread.Process('Info', command.svn('info', '--xml'), paths[start:start + TARGETS_CHUNK_SIZE], False, False)
+        infos.update(parse_info(p.output()))
+    return infos
+
+
+def db_info(path):
+    """Reads the info of a path from wc.db, False if the database can not answer"""
+    node = wcdb.lookup(status.find_root(path), path)
+    if not node:
+        return node
+    return {
+        'url': node['url'],
+        'revision': node['revision'],
+        'last_changed_rev': node['last_changed_rev'],
+        'kind': node['kind']
+    }
+
+
+def get_infos(paths):
+    """Gets the info of many paths at once, reading wc.db first and batching the rest into svn info calls"""
+    infos = {}
+    remaining = []
+    for path in paths:
+        if path in infos:
+            continue
+        infos[path] = None
+        if status.find_root(path) is None:
+            continue
+        found = db_info(path)
+        if found is False:
+            remaining.append(path)
+        else:
+            infos[path] = found
+    if remaining:
+        found = cli_infos(remaining)
+        for path in remaining:
+            infos[path] = found.get(status.normalize(path))
+        util.debug('Batched svn info for %d paths' % len(remaining))
+    return infos
+
+
+def get_info(path):
+    """Gets the url, revision, last changed revision and kind of a path, None if it is not versionned"""
+    return get_infos([path])[path]
+
+
+def versionned(paths):
+    """Checks which of the paths are versionned, returns a dictionary of path to boolean"""
+    return dict((path, found is not None) for path, found in get_infos(paths).items())
+
+
+def is_versionned(paths):
+    """Checks if any of the paths are versionned"""
+    return any(versionned(paths).values())
+
+
+def get_url(path):
+    """Gets the repository URL of a path, asking svn for the URL alone when wc.db can not answer"""
+    if status.find_root(path) is None:
+        return None
+    found = db_info(path)
+    if found is False and capabilities.supports('info', '--show-item'):
+        p = thread.Process('Info', command.svn('info', '--show-item', 'url'), [path], False, False)
+        url = (p.output() or '').strip()
+        return url if p.returncode == 0 and url else None
+    if found is False:
+        found = get_info(path)
+    return found['url'] if found else None
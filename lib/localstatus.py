@@ -0,0 +1,435 @@
+import configparser
+import fnmatch
+import hashlib
+import os
+import stat
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from . import util
+
+# conflict_data was added to ACTUAL_NODE in format 30 (Subversion 1.8)
+SUPPORTED_FORMATS = (30, 31)
+ADMIN_DIR = '.svn'
+WORKERS = 8
+CHUNK_SIZE = 65536
+DEFAULT_GLOBAL_IGNORES = (
+    '*.o *.lo *.la *.al .libs *.so *.so.[0-9]* *.a *.pyc *.pyo __pycache__ '
+    '*.rej *~ #*# .#* .*.swp .DS_Store [Tt]humbs.db'
+)
+TRANSLATION_PROPS = (b'svn:eol-style', b'svn:keywords', b'svn:special')
+DELETED_PRESENCE = ('base-deleted', 'not-present', 'excluded')
+SKEL_SPACE = b'() \t\n\r\f'
+
+scandir = getattr(os, 'scandir', None)
+
+
+def parse_props(data):
+    """Parses a property skel from wc.db into a dictionary"""
+    props = {}
+    if not data:
+        return props
+    atoms = []
+    pos = 0
+    size = len(data)
+    while pos < size:
+        c = data[pos:pos + 1]
+        if c in SKEL_SPACE:
+            pos = pos + 1
+            continue
+        end = pos
+        if c.isdigit():
+            while data[end:end + 1].isdigit():
+                end = end + 1
+            start = end + 1
+            length = int(data[pos:end])
+            atoms.append(data[start:start + length])
+            pos = start + length
+        else:
+            while end < size and data[end:end + 1] not in SKEL_SPACE:
+                end = end + 1
+            atoms.append(data[pos:end])
+            pos = end
+    for name, value in zip(atoms[0::2], atoms[1::2]):
+        props[name.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+    return props
+
+
+def parse_skel(data):
+    """Parses a skel from wc.db into nested lists of byte strings"""
+    stack = [[]]
+    pos = 0
+    size = len(data or b'')
+    while pos < size:
+        c = data[pos:pos + 1]
+        if c == b'(':
+            stack.append([])
+            pos = pos + 1
+        elif c == b')':
+            if len(stack) > 1:
+                done = stack.pop()
+                stack[-1].append(done)
+            pos = pos + 1
+        elif c in SKEL_SPACE:
+            pos = pos + 1
+        elif c.isdigit():
+            end = pos
+            while data[end:end + 1].isdigit():
+                end = end + 1
+            start = end + 1
+            stack[-1].append(data[start:start + int(data[pos:end])])
+            pos = start + int(data[pos:end])
+        else:
+            end = pos
+            while end < size and data[end:end + 1] not in SKEL_SPACE:
+                end = end + 1
+            stack[-1].append(data[pos:end])
+            pos = end
+    return stack[0][0] if len(stack[0]) == 1 and isinstance(stack[0][0], list) else stack[0]
+
+
+def conflict_kinds(data):
+    """Gets the kinds of conflicts (text, prop, tree) recorded in the conflict skel of a node"""
+    if not data:
+        return set()
+    if isinstance(data, str):
+        data = data.encode('utf-8')
+    skel = parse_skel(data)
+    # a conflict skel is (operation (conflict+)), each conflict starting with its kind
+    if len(skel) < 2 or not isinstance(skel[1], list):
+        return set()
+    return set(
+        conflict[0].decode('utf-8', 'replace')
+        for conflict in skel[1] if isinstance(conflict, list) and conflict and not isinstance(conflict[0], list)
+    )
+
+
+def config_path():
+    """Gets the path to the user's Subversion runtime configuration"""
+    if os.name == 'nt':
+        return os.path.join(os.environ.get('APPDATA', ''), 'Subversion', 'config')
+    return os.path.expanduser(os.path.join('~', '.subversion', 'config'))
+
+
+def global_ignores():
+    """Gets the global-ignores patterns from the Subversion configuration"""
+    patterns = DEFAULT_GLOBAL_IGNORES
+    config = configparser.RawConfigParser()
+    try:
+        config.read(config_path())
+        if config.has_option('miscellany', 'global-ignores'):
+            patterns = config.get('miscellany', 'global-ignores')
+    except configparser.Error as e:
+        util.debug('Unable to read Subversion config: ' + str(e))
+    return patterns.split()
+
+
+def mtime_us(st):
+    """Gets the modification time of a stat result in microseconds, as recorded by Subversion"""
+    ns = getattr(st, 'st_mtime_ns', None)
+    if ns is not None:
+        return ns // 1000
+    return int(st.st_mtime * 1000000)
+
+
+def disk_entry(st):
+    """Gets the (kind, size, mtime) of a stat result"""
+    if stat.S_ISDIR(st.st_mode):
+        kind = 'dir'
+    elif stat.S_ISLNK(st.st_mode):
+        kind = 'symlink'
+    else:
+        kind = 'file'
+    return (kind, st.st_size, mtime_us(st))
+
+
+def list_dir(path):
+    """Lists a directory with the (kind, size, mtime) of each entry, None if it can not be read"""
+    entries = {}
+    try:
+        if scandir is not None:
+            for entry in scandir(path):
+                entries[entry.name] = disk_entry(entry.stat(follow_symlinks=False))
+        else:
+            for name in os.listdir(path):
+                entries[name] = disk_entry(os.lstat(os.path.join(path, name)))
+    except OSError:
+        return None
+    return entries
+
+
+def sha1(path):
+    """Computes the SHA-1 checksum of a file"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = f.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def join(relpath, name):
+    """Joins a wc.db relative path and a name"""
+    return relpath + '/' + name if relpath else name
+
+
+class Node:
+    """The recorded state of a versionned node"""
+    __slots__ = (
+        'op_depth', 'presence', 'kind', 'revision', 'size', 'mtime',
+        'checksum', 'properties', 'base_present'
+    )
+
+    def __init__(self, row, base_present):
+        """Initializes a Node from its top-most NODES row"""
+        (
+            _, self.op_depth, self.presence, self.kind, self.revision,
+            self.size, self.mtime, self.checksum, self.properties
+        ) = row
+        self.base_present = base_present
+
+
+def file_stamp(path):
+    """Gets the (mtime, size) of a file, None if it does not exist"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return None
+    return (mtime_us(st), st.st_size)
+
+
+class Records:
+    """The recorded state of a working copy, read from wc.db once per change of wc.db"""
+    cache = {}
+    lock = threading.Lock()
+
+    def get(db):
+        """Gets the records of a working copy, reading wc.db again only if it or the Subversion config changed"""
+        stamp = (file_stamp(os.path.join(db.root, ADMIN_DIR, 'wc.db')), file_stamp(config_path()))
+        with Records.lock:
+            cached = Records.cache.get(db.root)
+        if cached is not None and cached[0] == stamp:
+            return cached[1]
+        records = Records(db)
+        with Records.lock:
+            Records.cache[db.root] = (stamp, records)
+        return records
+
+    def forget(root=None):
+        """Forgets the records of a working copy, or of all of them"""
+        with Records.lock:
+            if root is None:
+                Records.cache.clear()
+            else:
+                Records.cache.pop(root, None)
+
+    def __init__(self, db):
+        """Initializes the Records by reading the nodes, actual nodes and locks of the working copy"""
+        self.nodes = {}
+        self.children = {}
+        self.actual = {}
+        self.locked = set(db.locked_nodes())
+        self.global_ignores = global_ignores()
+        base_present = False
+        for row in db.nodes():
+            relpath = row[0]
+            if row[1] == 0:
+                base_present = row[2] == 'normal'
+                if relpath:
+                    self.children.setdefault(relpath.rpartition('/')[0], []).append(relpath)
+            elif relpath not in self.nodes:
+                base_present = False
+                if relpath:
+                    self.children.setdefault(relpath.rpartition('/')[0], []).append(relpath)
+            self.nodes[relpath] = Node(row, base_present)
+        for relpath, properties, conflict_data in db.actual_nodes():
+            self.actual[relpath] = (properties, conflict_kinds(conflict_data))
+
+
+class Scanner:
+    """Computes the status of a working copy from its records and the file system"""
+
+    def __init__(self, root, records):
+        """Initializes the Scanner"""
+        self.root = root
+        self.nodes = records.nodes
+        self.children = records.children
+        self.actual = records.actual
+        self.locked = records.locked
+        self.global_ignores = records.global_ignores
+        self.deferred = []
+
+    def abspath(self, relpath):
+        """Gets the absolute path of a relative path"""
+        return os.path.join(self.root, *relpath.split('/')) if relpath else self.root
+
+    def properties(self, relpath):
+        """Gets the current properties skel of a node"""
+        node = self.nodes[relpath]
+        actual = self.actual.get(relpath)
+        props = node.properties
+        if actual is not None and actual[0] is not None:
+            props = actual[0]
+        if isinstance(props, str):
+            props = props.encode('utf-8')
+        return props
+
+    def ignores(self, relpath):
+        """Gets the ignore patterns that apply to the children of a directory"""
+        patterns = list(self.global_ignores)
+        props = parse_props(self.properties(relpath))
+        patterns.extend(props.get('svn:ignore', '').split())
+        current = relpath
+        while True:
+            inherited = parse_props(self.properties(current)).get('svn:global-ignores')
+            if inherited:
+                patterns.extend(inherited.split())
+            if not current:
+                break
+            current = current.rpartition('/')[0]
+        return patterns
+
+    def is_modified(self, relpath, node, disk):
+        """Compares a file against its recorded size and time, checksumming only when needed"""
+        kind, size, mtime = disk
+        props = self.properties(relpath) or b''
+        translated = any(name in props for name in TRANSLATION_PROPS)
+        if node.size is not None and node.size >= 0 and size != node.size and kind == 'file':
+            return True
+        if node.mtime is not None and mtime == node.mtime and size == node.size:
+            return False
+        if translated or kind != 'file':
+            # the pristine checksum is of the normal form, let svn detranslate the file
+            self.deferred.append(self.abspath(relpath))
+            return False
+        if not node.checksum or not node.checksum.startswith('$sha1$'):
+            return True
+        try:
+            return sha1(self.abspath(relpath)) != node.checksum[6:]
+        except (IOError, OSError):
+            return True
+
+    def node_status(self, relpath, disk):
+        """Gets the (item, props) status of a versionned node"""
+        node = self.nodes[relpath]
+        actual = self.actual.get(relpath)
+        conflicts = actual[1] if actual is not None else set()
+        if 'prop' in conflicts:
+            props = 'conflicted'
+        elif actual is not None and actual[0] is not None and actual[0] != node.properties:
+            props = 'modified'
+        else:
+            props = 'normal' if node.properties else 'none'
+        depth = relpath.count('/') + 1 if relpath else 0
+        if node.presence in DELETED_PRESENCE:
+            return 'deleted', props
+        if 'text' in conflicts:
+            return 'conflicted', props
+        if disk is None:
+            return 'missing', props
+        if (disk[0] == 'dir') != (node.kind == 'dir'):
+            return 'obstructed', props
+        if node.op_depth > 0 and node.op_depth == depth:
+            return ('replaced' if node.base_present else 'added'), props
+        if node.kind == 'file' and self.is_modified(relpath, node, disk):
+            return 'modified', props
+        return 'normal', props
+
+    def entry(self, relpath, item, props, kind):
+        """Builds a status entry for a path"""
+        node = self.nodes.get(relpath)
+        actual = self.actual.get(relpath)
+        return (self.abspath(relpath), {
+            'item': item,
+            'props': props,
+            'revision': str(node.revision) if node is not None and node.revision is not None else None,
+            'tree-conflicted': actual is not None and 'tree' in actual[1],
+            'locked': relpath in self.locked,
+            'kind': kind
+        })
+
+    def is_nested(self, path):
+        """Checks if an unversionned directory is a separate working copy"""
+        return os.path.isdir(os.path.join(path, ADMIN_DIR))
+
+    def scan_dir(self, relpath):
+        """Gets the status of the children of a directory and the subdirectories to scan next"""
+        listing = list_dir(self.abspath(relpath))
+        if listing is None:
+            return [], []
+        results = []
+        subdirs = []
+        names = set()
+        for child in self.children.get(relpath, []):
+            name = child.rpartition('/')[2]
+            names.add(name)
+            node = self.nodes[child]
+            if node.presence not in ('normal', 'incomplete') and node.presence not in DELETED_PRESENCE:
+                continue
+            if node.presence in DELETED_PRESENCE and node.op_depth == 0:
+                continue
+            disk = listing.get(name)
+            item, props = self.node_status(child, disk)
+            results.append(self.entry(child, item, props, node.kind))
+            if node.kind == 'dir' and item not in ('missing', 'deleted', 'obstructed'):
+                subdirs.append(child)
+        patterns = None
+        for name, disk in listing.items():
+            if name in names or name == ADMIN_DIR:
+                continue
+            if patterns is None:
+                patterns = self.ignores(relpath)
+            if any(fnmatch.fnmatchcase(name, pattern) for pattern in patterns):
+                continue
+            child = join(relpath, name)
+            if disk[0] == 'dir' and self.is_nested(self.abspath(child)):
+                continue
+            results.append(self.entry(child, 'unversioned', 'none', 'dir' if disk[0] == 'dir' else 'file'))
+        return results, subdirs
+
+    def scan(self, relpaths=None, depth='infinity'):
+        """Gets the status of the paths below the relative paths, or the whole working copy"""
+        if relpaths is None:
+            relpaths = ['']
+        results = []
+        level = []
+        for relpath in relpaths:
+            node = self.nodes.get(relpath)
+            try:
+                disk = disk_entry(os.lstat(self.abspath(relpath)))
+            except OSError:
+                disk = None
+            if node is None:
+                if disk is not None:
+                    results.append(self.entry(relpath, 'unversioned', 'none', 'dir' if disk[0] == 'dir' else 'file'))
+                continue
+            item, props = self.node_status(relpath, disk)
+            results.append(self.entry(relpath, item, props, node.kind))
+            if node.kind == 'dir' and item not in ('missing', 'deleted', 'obstructed'):
+                level.append(relpath)
+        with ThreadPoolExecutor(max_workers=WORKERS) as pool:
+            while level:
+                next_level = []
+                for found, subdirs in pool.map(self.scan_dir, level):
+                    results.extend(found)
+                    next_level.extend(subdirs)
+                level = next_level if depth == 'infinity' else []
+        return results
+
+
+def scan(db, paths=None, depth='infinity'):
+    """Gets the status entries and the paths that need svn to decide, None if wc.db is not supported"""
+    if db is None or db.format not in SUPPORTED_FORMATS:
+        return None
+    start = time.time()
+    scanner = Scanner(db.root, Records.get(db))
+    relpaths = None
+    if paths is not None:
+        relpaths = [relpath for relpath in map(db.relpath, paths) if not relpath.startswith('..')]
+    results = scanner.scan(relpaths, depth)
+    util.debug('Local status of %s: %d entries, %d deferred to svn, %.3fs' % (
+        db.root, len(results), len(scanner.deferred), time.time() - start
+    ))
+    return results, scanner.deferred
@@ -0,0 +1,188 @@
+import sublime
+import os
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from functools import partial
+from . import command, localstatus, settings, status, thread, util, wcdb
+
+NEEDS_LOCK = 'svn:needs-lock'
+DEFAULT_TIMEOUT = 300
+
+
+class Locks:
+    """Remembers which files of each working copy need a lock, and who holds the locks"""
+    maps = {}
+    pending = {}
+    lock = threading.Lock()
+
+
+class LockMap:
+    """The needs-lock files and lock owners of a working copy"""
+
+    def __init__(self, root, db_stat):
+        """Initializes a LockMap"""
+        self.root = root
+        self.db_stat = db_stat
+        self.timestamp = time.time()
+        self.needs_lock = set()
+        self.owners = {}
+        self.own = set()
+
+    def lookup(self, path):
+        """Gets the lock state of a file"""
+        key = status.normalize(path)
+        return {
+            'needs_lock': key in self.needs_lock,
+            'owner': self.owners.get(key),
+            'own': key in self.own
+        }
+
+
+def to_bytes(props):
+    """Gets a property skel as bytes"""
+    if isinstance(props, str):
+        return props.encode('utf-8')
+    return props or b''
+
+
+def db_needs_lock(root):
+    """Reads the files with svn:needs-lock from wc.db, None if it can not be read"""
+    db = wcdb.get(root)
+    if db is None:
+        return None
+    try:
+        props = {}
+        for row in db.nodes():
+            props[row[0]] = row[8]
+        for relpath, properties, conflict_data in db.actual_nodes():
+            if properties is not None:
+                props[relpath] = properties
+    except wcdb.sqlite3.Error as e:
+        util.debug('wc.db properties lookup failed for %s: %s' % (root, str(e)))
+        return None
+    found = set()
+    for relpath, properties in props.items():
+        properties = to_bytes(properties)
+        if NEEDS_LOCK.encode('utf-8') in properties and NEEDS_LOCK in localstatus.parse_props(properties):
+            found.add(status.normalize(os.path.join(root, *relpath.split('/'))))
+    return found
+
+
+def cli_needs_lock(root):
+    """Finds the files with svn:needs-lock with a recursive svn propget"""
+    cmd = command.svn('propget', NEEDS_LOCK, '--recursive', '--xml')
+    p = thread.Process('Needs Lock', cmd, [root], False, False, root=root)
+    found = set()
+    try:
+        tree = ElementTree.fromstring((p.output() or '').strip())
+    except ElementTree.ParseError as e:
+        util.debug('Unable to parse properties: ' + str(e))
+        return found
+    for target in tree.iter('target'):
+        found.add(status.normalize(target.get('path')))
+    return found
+
+
+def fetch_owners(root, lock_map):
+    """Reads the lock owners of a working copy from the repository with svn status -u, then publishes the map"""
+    cmd = command.svn('status', '--show-updates', '--verbose', '--xml')
+    thread.Process(
+        'Lock Owners', cmd, [root], False, True, partial(on_owners, root, lock_map),
+        priority=thread.BACKGROUND, root=root
+    )
+
+
+def parse_owners(raw, lock_map):
+    """Fills the lock owners of a map from the output of svn status -u"""
+    try:
+        tree = ElementTree.fromstring((raw or '').strip())
+    except ElementTree.ParseError as e:
+        util.debug('Unable to read the locks of %s: %s' % (lock_map.root, str(e)))
+        return
+    for entry in tree.iter('entry'):
+        key = status.normalize(entry.get('path'))
+        local = entry.find('wc-status/lock')
+        remote = entry.find('repos-status/lock')
+        if local is not None:
+            lock_map.own.add(key)
+        if remote is not None and local is None:
+            owner = remote.find('owner')
+            lock_map.owners[key] = owner.text if owner is not None else '?'
+
+
+def on_owners(root, lock_map, process):
+    """Completes a lock map with the lock owners read from the repository"""
+    try:
+        parse_owners(process.output(), lock_map)
+    finally:
+        publish(root, lock_map)
+
+
+def load(root):
+    """Builds the lock map of a working copy from the working copy alone"""
+    lock_map = LockMap(root, status.db_stat(root))
+    found = db_needs_lock(root)
+    lock_map.needs_lock = found if found is not None else cli_needs_lock(root)
+    db = wcdb.get(root)
+    if db is not None:
+        try:
+            lock_map.own = set(status.normalize(os.path.join(root, *relpath.split('/'))) for relpath in db.locked_nodes())
+        except wcdb.sqlite3.Error as e:
+            util.debug('wc.db locks lookup failed for %s: %s' % (root, str(e)))
+    return lock_map
+
+
+def publish(root, lock_map):
+    """Stores a lock map and answers the checks waiting for it, with None if it could not be built"""
+    with Locks.lock:
+        if lock_map is not None:
+            Locks.maps[root] = lock_map
+        callbacks = Locks.pending.pop(root, [])
+    if lock_map is not None:
+        util.debug('Lock map of %s: %d files need a lock, %d locked by others, %.3fs' % (
+            root, len(lock_map.needs_lock), len(lock_map.owners), time.time() - lock_map.timestamp
+        ))
+    for path, callback in callbacks:
+        callback(lock_map.lookup(path) if lock_map is not None else None)
+
+
+def refresh(root):
+    """Rebuilds the lock map of a working copy, the owners are read from the repository without blocking"""
+    try:
+        lock_map = load(root)
+    except Exception as e:
+        util.debug('Unable to build the lock map of %s: %s' % (root, str(e)))
+        publish(root, None)
+        return
+    if lock_map.needs_lock:
+        fetch_owners(root, lock_map)
+    else:
+        publish(root, lock_map)
+
+
+def is_stale(lock_map):
+    """Checks if a lock map should be rebuilt"""
+    timeout = settings.get('lockCacheTimeout', default=DEFAULT_TIMEOUT)
+    if time.time() - lock_map.timestamp > timeout:
+        return True
+    return status.db_stat(lock_map.root) != lock_map.db_stat
+
+
+def check(path, callback):
+    """Calls callback with the cached lock state of a file, svn only runs in the background to fill the cache"""
+    root = status.find_root(path)
+    if root is None:
+        return
+    start = False
+    with Locks.lock:
+        lock_map = Locks.maps.get(root)
+        if lock_map is None or is_stale(lock_map):
+            start = root not in Locks.pending
+            waiting = Locks.pending.setdefault(root, [])
+            if lock_map is None:
+                waiting.append((path, callback))
+    if start:
+        sublime.set_timeout_async(partial(refresh, root), 0)
+    if lock_map is not None:
+        callback(lock_map.lookup(path))
@@ -1,12 +1,21 @@
 import sublime
 import sublime_plugin
 import re
-from . import util, settings
+import threading
+import time
+from . import util, settings, transcript
 
 VIEW_NAME = 'SVN Output'
 PANEL_ID = 'svn-output'
 SYNTAX = 'Packages/HypnotoadSVN/languages/SVN Output.hidden-tmLanguage'
 INDENT_LEVEL = 4
+# milliseconds between two writes of the queued messages to the view
+FLUSH_INTERVAL = 30
+# characters kept in the view, 0 keeps everything
+DEFAULT_MAX_SIZE = 2000000
+# the view is trimmed below its maximum size so it is not trimmed on every write
+TRIM_RATIO = 0.75
+SECTION_MATCH = r'^Command: '
 
 CONFLICTS_MATCH = r"^ +C .*?$"
 CONFLICTS_GUTTER_KEY = "svn-conflicts"
@@ -24,18 +33,29 @@ CONFLICT_HIGHLIGHTS = {
 }
 
 
-class SvnView:
-    """Handles the SVN Output view/panel"""
-    buffer = ""
-    view = None
-    panel = None
-
-    def find_existing_view():
+class Channel:
+    """The SVN Output view/panel of a single window, with the messages waiting to be written to it"""
+
+    def __init__(self, window):
+        """Initializes the Channel"""
+        self.window = window
+        self.view = None
+        self.panel = None
+        self.buffer = ""
+        self.pending = []
+        self.queued_at = None
+        self.scheduled = False
+        self.command_at = None
+        self.focusing = False
+        self.ending = False
+        self.streaming = None
+        self.waiting = []
+
+    def find_existing_view(self):
         """Finds a view that matches the signature of an SVN Output view"""
-        if SvnView.view:
-            return SvnView.view
-        views = sublime.active_window().views()
-        for view in views:
+        if self.view:
+            return self.view
+        for view in self.window.views():
             if (
                 view.name() == VIEW_NAME
                 and view.is_read_only()
@@ -44,218 +64,546 @@ class SvnView:
                 return view
         return None
 
-    def get_existing():
+    def get_existing(self):
         """Gets a view if one exists, does not create one if it does not"""
         output = settings.get_native("outputTo", "panel")
         if output == "tab":
-            return SvnView.find_existing_view()
-        if output == "panel" and SvnView.panel:
-            return SvnView.panel
+            return self.find_existing_view()
+        if output == "panel" and self.panel:
+            return self.panel
         return None
 
-    def get():
+    def get(self):
         """Gets a view or panel for output, creates one if none available"""
         output = settings.get_native("outputTo", "panel")
         if output == "dialog":
             return None
         if output == "tab":
-            if SvnView.view is None or SvnView.view.window() is None:
-                SvnView.view = None
-                view = SvnView.find_existing_view()
+            if self.view is None or self.view.window() is None:
+                self.view = None
+                view = self.find_existing_view()
                 if view is None:
-                    view = sublime.active_window().new_file()
+                    view = self.window.new_file()
                     view.set_scratch(True)
                     view.set_name(VIEW_NAME)
                     view.set_read_only(True)
                 view.set_syntax_file(SYNTAX)
-                SvnView.view = view
-            return SvnView.view
-        if SvnView.panel is None:
-            panel = sublime.active_window().create_output_panel(PANEL_ID)
+                self.view = view
+            return self.view
+        if self.panel is None:
+            panel = self.window.create_output_panel(PANEL_ID)
             panel.set_syntax_file(SYNTAX)
-            SvnView.panel = panel
-        sublime.active_window().run_command(
+            self.panel = panel
+        self.window.run_command(
             'show_panel',
             {
                 'panel': 'output.' + PANEL_ID
             }
         )
-        return SvnView.panel
-
-    def message(message):
-        """Sends a message to the output"""
+        return self.panel
+
+    def message(self, message, command=False):
+        """Queues a message for the next write to the output"""
+        with SvnView.lock:
+            if command:
+                self.command_at = len(self.pending)
+                self.focusing = True
+            self.pending.append(message)
+            if self.queued_at is None:
+                self.queued_at = time.time()
+            if self.scheduled:
+                return
+            self.scheduled = True
+        sublime.set_timeout(self.flush, FLUSH_INTERVAL)
+
+    def add(self, section, message, command=False):
+        """Writes the message of a section, or keeps it in the section while another section of the window is written"""
+        with SvnView.lock:
+            if self.streaming is None:
+                self.streaming = section
+            if self.streaming is section:
+                self.message(message, command)
+                return
+            if command:
+                section.command_at = len(section.lines)
+            section.lines.append(message)
+            section.size = section.size + len(message)
+            self.bound(section)
+            if section not in self.waiting:
+                self.waiting.append(section)
+
+    def bound(self, section):
+        """Drops the oldest output of a waiting section once it is larger than the view may be"""
+        limit = settings.get_native('outputMaxSize', DEFAULT_MAX_SIZE)
+        if limit <= 0:
+            limit = DEFAULT_MAX_SIZE
+        if section.size <= limit:
+            return
+        # the command line stays, the output after it is dropped down to the size the view is trimmed to
+        head = section.command_at + 1 if section.command_at is not None else 0
+        end = head
+        target = int(limit * TRIM_RATIO)
+        while end < len(section.lines) - 1 and section.size > target:
+            section.size = section.size - len(section.lines[end])
+            end = end + 1
+        section.omitted = section.omitted + end - head
+        del section.lines[head:end]
+
+    def release(self, section):
+        """Ends a section, the next waiting sections are written as whole blocks"""
+        with SvnView.lock:
+            if self.streaming is not section:
+                return
+            self.ending = True
+            self.streaming = None
+            while self.waiting:
+                waiting = self.waiting.pop(0)
+                lines = waiting.lines
+                if waiting.omitted > 0:
+                    head = waiting.command_at + 1 if waiting.command_at is not None else 0
+                    lines = lines[:head] + [indent('(%d lines omitted)' % waiting.omitted)] + lines[head:]
+                for index, line in enumerate(lines):
+                    self.message(line, index == waiting.command_at)
+                waiting.lines = []
+                waiting.size = 0
+                waiting.omitted = 0
+                if not waiting.ended:
+                    self.streaming = waiting
+                    return
+
+    def flush(self):
+        """Writes the queued messages to the output in one edit, scrolling once"""
+        with SvnView.lock:
+            messages = self.pending
+            command_at = self.command_at
+            focusing = self.focusing
+            ending = self.ending
+            queued_at = self.queued_at
+            self.pending = []
+            self.command_at = None
+            self.focusing = False
+            self.ending = False
+            self.queued_at = None
+            self.scheduled = False
+        if not messages:
+            return
+        text = re.sub(r'\r\n?', '\n', '\n'.join(messages))
+        SvnView.count(len(messages), time.time() - queued_at)
+        transcript.write(text)
         output = settings.get_native("outputTo", "panel")
         if output == "dialog":
-            SvnView.buffer = SvnView.buffer + message + "\n"
+            self.buffer = self.buffer + text + "\n"
+            if ending:
+                sublime.message_dialog(self.buffer)
+                self.buffer = ""
             return
-        view = SvnView.get()
+        view = self.get()
         if view is None:
             return
-        msg = re.sub(r'\r\n?', '\n', message)
+        if focusing and view.window() is not None:
+            view.window().focus_view(view)
+        start = view.size()
         view.run_command(
             'hypno_view_message',
             {
-                "message": msg
+                "message": text
+            }
+        )
+        scroll = settings.get_native('outputScrollTo', default="command")
+        if scroll == "bottom":
+            view.show(view.size(), False)
+        elif scroll == "command" and command_at is not None:
+            before = re.sub(r'\r\n?', '\n', '\n'.join(messages[:command_at]))
+            offset = len(before) + 1 if command_at > 0 else 0
+            point = view.text_to_layout(start + offset)
+            view.set_viewport_position(point, True)
+        self.trim(view)
+
+    def trim(self, view):
+        """Removes the oldest commands from the view once it is larger than the maximum size"""
+        limit = settings.get_native('outputMaxSize', DEFAULT_MAX_SIZE)
+        if limit <= 0 or view.size() <= limit:
+            return
+        target = view.size() - int(limit * TRIM_RATIO)
+        starts = [start for start in SvnView.sections.get(view.id(), []) if start <= target]
+        if starts and starts[-1] > 0:
+            util.debug('Output: removed %d characters of older commands from the view' % starts[-1])
+            view.run_command(
+                'hypno_view_trim',
+                {
+                    "size": starts[-1]
+                }
+            )
+            return
+        # a single command is larger than the view may be: the start of its output goes, its command line stays
+        section = starts[-1] if starts else 0
+        head = view.full_line(section).b
+        end = view.full_line(target).b
+        if end <= head:
+            return
+        omitted = end - head
+        previous = SvnView.omitted.get(view.id())
+        if previous is not None and previous[0] == section:
+            # the marker of the previous trim is removed along with the output after it
+            omitted = omitted + previous[1] - len(omission(previous[1]))
+        SvnView.omitted[view.id()] = (section, omitted)
+        util.debug('Output: removed %d characters of the current command from the view' % (end - head))
+        view.run_command(
+            'hypno_view_trim',
+            {
+                "start": head,
+                "size": end,
+                "marker": omission(omitted)
             }
         )
-        if settings.get_native('outputScrollTo') == "bottom":
-            SvnView.scroll_bottom_to_visible()
 
-    def clear():
+    def clear(self):
         """Clears the output view"""
-        view = SvnView.get()
+        self.flush()
+        view = self.get()
         if view is None:
             return
         view.run_command('hypno_view_clear')
 
-    def end():
-        """Sends the end signal to the output"""
-        output = settings.get_native("outputTo", "panel")
-        if output == "dialog":
-            sublime.message_dialog(SvnView.buffer)
-        SvnView.buffer = ""
-        SvnView.message(indent("Completed\n"))
-
-    def focus():
-        """Brings the output view into focus"""
-        view = SvnView.get()
+    def find(self, command_id):
+        """Finds the region of a command in the view, None if it is not there anymore"""
+        view = self.get_existing()
         if view is None:
-            return
-        view.window().focus_view(view)
+            return None
+        start = view.find(SECTION_MATCH + r'.* \[#' + str(command_id) + r'\]$', 0)
+        if start is None or start.a < 0:
+            return None
+        end = view.find(SECTION_MATCH, start.b)
+        return sublime.Region(start.a, end.a if end is not None and end.a >= 0 else view.size())
+
+    def show(self, command_id):
+        """Scrolls the view to a command, False if it is not there anymore"""
+        region = self.find(command_id)
+        if region is None:
+            return False
+        view = self.get()
+        view.set_viewport_position(view.text_to_layout(region.a), True)
+        return True
+
+    def close(self, view):
+        """Stop using the view if it has been closed"""
+        if view == self.view:
+            self.view = None
+        if view == self.panel:
+            self.panel = None
+
+
+class Section:
+    """The output of a single command, identified by its command ID"""
+    sequence = 0
+
+    def __init__(self, name, window=None):
+        """Initializes the Section, the output goes to the window active when the command was started"""
+        with SvnView.lock:
+            Section.sequence = Section.sequence + 1
+            self.id = Section.sequence
+        self.name = name
+        self.channel = SvnView.channel(window)
+        self.lines = []
+        self.size = 0
+        self.omitted = 0
+        self.command_at = None
+        self.ended = False
+
+    def add(self, message, command=False):
+        """Adds a message to the section"""
+        self.channel.add(self, message, command)
+
+    def end(self):
+        """Ends the section"""
+        with SvnView.lock:
+            self.add(indent("Completed\n"))
+            self.ended = True
+            self.channel.release(self)
 
-    def scroll_to_bottom():
-        """Scrolls the bottom of the view to the top of the viewport"""
-        view = SvnView.get()
-        if view is None:
-            return
-        point = view.text_to_layout(view.size())
-        view.set_viewport_position(point, True)
 
-    def scroll_bottom_to_visible():
-        """Scrolls the bottom of the view into visible space"""
-        view = SvnView.get()
-        if view is None:
-            return
-        view.show(view.size(), False)
+class SvnView:
+    """Handles the SVN Output views/panels of every window"""
+    channels = {}
+    lock = threading.RLock()
+    conflicts = {}
+    conflict_keys = 0
+    sections = {}
+    omitted = {}
+    flushes = 0
+    flushed_lines = 0
+    most_lines = 0
+    latency = 0
+    most_latency = 0
+
+    def channel(window=None):
+        """Gets the output of a window, the active one by default"""
+        window = window or sublime.active_window()
+        with SvnView.lock:
+            found = SvnView.channels.get(window.id())
+            if found is None:
+                found = Channel(window)
+                SvnView.channels[window.id()] = found
+            return found
+
+    def get_existing(window=None):
+        """Gets the output view of a window if one exists, does not create one if it does not"""
+        return SvnView.channel(window).get_existing()
+
+    def get(window=None):
+        """Gets the output view of a window, creates one if none available"""
+        return SvnView.channel(window).get()
+
+    def count(lines, latency):
+        """Keeps the number of lines and the latency of the writes to the output"""
+        SvnView.flushes = SvnView.flushes + 1
+        SvnView.flushed_lines = SvnView.flushed_lines + lines
+        SvnView.most_lines = max(SvnView.most_lines, lines)
+        SvnView.latency = SvnView.latency + latency
+        SvnView.most_latency = max(SvnView.most_latency, latency)
+        util.debug('Output: wrote %d messages after %.3fs (%s)' % (lines, latency, SvnView.describe()))
+
+    def describe():
+        """Describes the lines per write and write latency for debugging"""
+        if SvnView.flushes == 0:
+            return 'no writes'
+        return '%.1f messages per write, %d at most, %.3fs average latency, %.3fs at most' % (
+            SvnView.flushed_lines / SvnView.flushes, SvnView.most_lines,
+            SvnView.latency / SvnView.flushes, SvnView.most_latency
+        )
 
     def close(view):
         """Stop using the view if it has been closed"""
-        if view == SvnView.view:
-            SvnView.view = None
-        if view == SvnView.panel:
-            SvnView.panel = None
+        SvnView.conflicts.pop(view.id(), None)
+        SvnView.sections.pop(view.id(), None)
+        SvnView.omitted.pop(view.id(), None)
+        with SvnView.lock:
+            channels = list(SvnView.channels.values())
+        for channel in channels:
+            channel.close(view)
 
 
 def indent(text="", spaces=INDENT_LEVEL):
     """Indents a message for output"""
-    return " " * spaces + re.sub(r'\n', '\n' + " " * spaces, text)
+    return " " * spaces + text.replace('\n', '\n' + " " * spaces)
+
+
+def omission(size):
+    """Gets the line left in place of the output removed from a command"""
+    return indent('(%d characters omitted)' % size) + '\n'
 
 
-def add_message(message):
-    """Add a message to output"""
-    SvnView.message(message)
+def add_message(section, message):
+    """Add a message to the section of a command"""
+    section.add(message)
 
 
-def add_command(name, cmd=None):
-    """Adds a named command to output"""
-    SvnView.focus()
-    if settings.get_native('outputScrollTo', default="command") == "command":
-        SvnView.scroll_to_bottom()
-    add_message("Command: " + name)
+def add_command(section, cmd=None):
+    """Adds the name and ID of a command to output"""
+    section.add("Command: " + section.name + " [#" + str(section.id) + "]", True)
     if settings.get_native("outputRawCommand") and cmd is not None:
-        add_message(indent(cmd))
+        add_message(section, indent(cmd))
 
 
-def add_files(paths=None):
+def add_files(section, paths=None):
     """Add a list of files to output"""
     if paths is None:
         return
     s = paths
     if isinstance(paths, list):
         s = "\n".join(paths)
-    add_message(indent("Files:\n" + indent(s)))
+    add_message(section, indent("Files:\n" + indent(s)))
 
 
-def add_files_section():
+def add_files_section(section):
     """Adds a files section to output"""
-    add_message(indent("Files:"))
+    add_message(section, indent("Files:"))
 
 
-def add_result(result):
+def add_result(section, result):
     """Adds results to output"""
     if result:
-        add_message(indent("Output:\n" + indent(result)))
+        add_message(section, indent("Output:\n" + indent(result)))
 
 
-def add_result_section():
+def add_result_section(section):
     """Opens a result section in output"""
-    add_message(indent("Output:"))
+    add_message(section, indent("Output:"))
 
 
-def add_result_message(result):
+def add_result_message(section, result):
     """Adds a result message to output"""
-    add_message(indent(result, INDENT_LEVEL * 2))
+    add_message(section, indent(result, INDENT_LEVEL * 2))
 
 
-def add_error(err, code=None):
+def add_error_message(section, err):
+    """Adds a single error line next to the result messages"""
+    add_message(section, indent("Error: " + err, INDENT_LEVEL * 2))
+
+
+def add_error(section, err, code=None):
     """Adds errors to output"""
     if err:
-        add_message(indent("Error: " + str(code if code is not None else "") + "\n" + indent(err)))
+        add_message(section, indent("Error: " + str(code if code is not None else "") + "\n" + indent(err)))
 
 
-def add_error_section(code=None):
+def add_error_section(section, code=None):
     """Opens an error section in output"""
-    add_message(indent("Error: " + str(code if code is not None else "")))
+    add_message(section, indent("Error: " + str(code if code is not None else "")))
+
+
+def add_command_block(name, cmd=None, paths=None, records=None, code=None, window=None):
+    """Adds a complete command with its (timestamp, stream, line) records as a section of its own"""
+    section = Section(name, window)
+    add_command(section, cmd)
+    add_files(section, paths)
+    add_result_section(section)
+    errors = False
+    for timestamp, stream, line in records or []:
+        if stream == 'stderr':
+            errors = True
+            add_error_message(section, line.strip('\r\n'))
+        else:
+            add_result_message(section, line.strip('\r\n'))
+    if errors:
+        add_error_section(section, code)
+    end_command(section)
+    return section
+
+
+def add_summary(title, rows, footer=None, window=None):
+    """Adds a summary of a command that ran on several working copies"""
+    section = Section(title, window)
+    add_command(section)
+    add_result_section(section)
+    for row in rows:
+        add_result_message(section, row)
+    if footer is not None:
+        add_message(section, indent(footer))
+    end_command(section)
+    return section
+
+
+def end_command(section):
+    """Ends a command in output"""
+    section.end()
 
 
-def end_command():
-    """Ends a command in output"""
-    SvnView.end()
+def clear(window=None):
+    """Clears the output view of a window"""
+    SvnView.channel(window).clear()
+
+
+def show_command(command_id, window=None):
+    """Scrolls the output view of a window to a command, False if it is not there anymore"""
+    return SvnView.channel(window).show(command_id)
 
 
-def clear():
-    """Clears the output view"""
-    SvnView.clear()
+def find_conflicts(text, start=0):
+    """Finds the regions of the conflicted files in text written at start in the view"""
+    return [
+        sublime.Region(start + m.start() + INDENT_LEVEL * 2, start + m.end())
+        for m in re.finditer(CONFLICTS_MATCH, text, re.M)
+    ]
 
 
-def highlight_conflicts():
-    """Highlights the conflicted files found in commands"""
+def add_conflicts(view, key, regions):
+    """Highlights conflict regions of a view under a key"""
     gutter = settings.get_native("outputGutter", "circle")
     highlight = settings.get_native("outputHighlight", "none")
-    if gutter == "none" and highlight == "none":
-        return
 
     if highlight in CONFLICT_HIGHLIGHTS:
         style = CONFLICT_HIGHLIGHTS[highlight]
     else:
         style = CONFLICT_HIGHLIGHTS["none"]
 
-    view = SvnView.get()
-    region = sublime.Region(0, view.size())
-    contents = view.substr(region)
-    size = 0
-    regions = []
-
-    lines = contents.split("\n")
-    for line in lines:
-        m = re.match(CONFLICTS_MATCH, line)
-        if m:
-            region = sublime.Region(size + 8, size + len(line))
-            regions.append(region)
-        size = size + len(line) + 1
-
-    if gutter is "none":
+    if gutter == "none":
         view.add_regions(
-            CONFLICTS_GUTTER_KEY,
+            key,
             regions,
             CONFLICTS_SCOPE,
             flags=style | sublime.PERSISTENT
         )
     else:
         view.add_regions(
-            CONFLICTS_GUTTER_KEY,
+            key,
             regions,
             CONFLICTS_SCOPE,
             gutter,
             flags=style | sublime.PERSISTENT
         )
+
+
+def highlight_conflicts(view, text, start):
+    """Highlights the conflicted files found in text just written at start in the view"""
+    gutter = settings.get_native("outputGutter", "circle")
+    highlight = settings.get_native("outputHighlight", "none")
+    if gutter == "none" and highlight == "none":
+        return
+
+    found = find_conflicts(text, start)
+    if not found:
+        return
+    # each write gets a key of its own, so only its regions are added to the view
+    SvnView.conflict_keys = SvnView.conflict_keys + 1
+    key = CONFLICTS_GUTTER_KEY + '-' + str(SvnView.conflict_keys)
+    SvnView.conflicts.setdefault(view.id(), []).append((key, found))
+    add_conflicts(view, key, found)
+
+
+def shift_conflicts(view, size, start=0, inserted=0):
+    """Moves the kept conflicts of a view after the characters from start to size were replaced by inserted ones"""
+    batches = SvnView.conflicts.get(view.id())
+    if batches is None:
+        return
+    moved = inserted - (size - start)
+    kept = []
+    for key, regions in batches:
+        remaining = [
+            region if region.b <= start else sublime.Region(region.a + moved, region.b + moved)
+            for region in regions if region.b <= start or region.a >= size
+        ]
+        if len(remaining) == len(regions):
+            # the view moves the regions it highlights by itself
+            kept.append((key, remaining))
+        elif remaining:
+            kept.append((key, remaining))
+            add_conflicts(view, key, remaining)
+        else:
+            view.erase_regions(key)
+    SvnView.conflicts[view.id()] = kept
+
+
+def forget_conflicts(view):
+    """Forgets the highlighted conflicts of a view that was cleared or closed"""
+    for key, regions in SvnView.conflicts.pop(view.id(), []):
+        view.erase_regions(key)
+
+
+def mark_sections(view, text, start):
+    """Keeps where the commands in text just written at start in the view begin"""
+    found = [start + m.start() for m in re.finditer(SECTION_MATCH, text, re.M)]
+    if found:
+        SvnView.sections.setdefault(view.id(), []).extend(found)
+
+
+def shift_sections(view, size, start=0, inserted=0):
+    """Moves the kept command starts of a view after the characters from start to size were replaced by inserted ones"""
+    starts = SvnView.sections.get(view.id())
+    if starts is None:
+        return
+    moved = inserted - (size - start)
+    SvnView.sections[view.id()] = [
+        found if found < start else found + moved for found in starts if found < start or found >= size
+    ]
+    omitted = SvnView.omitted.get(view.id())
+    if omitted is not None and start <= omitted[0] < size:
+        SvnView.omitted.pop(view.id(), None)
+    elif omitted is not None and omitted[0] >= size:
+        SvnView.omitted[view.id()] = (omitted[0] + moved, omitted[1])
+
+
+def forget_sections(view):
+    """Forgets the command starts of a view that was cleared"""
+    SvnView.sections.pop(view.id(), None)
+    SvnView.omitted.pop(view.id(), None)
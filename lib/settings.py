@@ -53,3 +53,11 @@ def get_tortoise(name, default=None):
 def get_tortoise_path():
     """Gets the path to TortoiseProc"""
     return Settings.get("tortoiseproc_path", "tortoiseSVN", "C:\\Program Files\\TortoiseSVN\\bin\\TortoiseProc.exe")
+
+
+def get_svn_path():
+    """Gets the path to the svn binary"""
+    svn_path = Settings.get("svnPath", "nativeSVN", False)
+    if svn_path is False:
+        return "svn"
+    return svn_path
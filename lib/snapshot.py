@@ -0,0 +1,92 @@
+import sublime
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from functools import partial
+from . import util
+
+VERSION = 2
+CACHE_FOLDER = 'cache'
+SAVE_DELAY = 5000
+FIELDS = ('path', 'item', 'props', 'revision', 'tree-conflicted', 'locked', 'kind')
+
+
+class Snapshots:
+    """Keeps track of the snapshots waiting to be written"""
+    pending = set()
+    lock = threading.Lock()
+
+
+def cache_folder():
+    """Gets the folder where snapshots are stored"""
+    return os.path.join(sublime.packages_path(), 'User', 'HypnotoadSVN', CACHE_FOLDER)
+
+
+def snapshot_path(root):
+    """Gets the snapshot file for a working copy root"""
+    name = hashlib.sha1(root.encode('utf-8')).hexdigest() + '.json.gz'
+    return os.path.join(cache_folder(), name)
+
+
+def save(root, entries, db_stat):
+    """Writes the entries of a working copy index to its snapshot"""
+    if db_stat is None:
+        return
+    start = time.time()
+    data = {
+        'version': VERSION,
+        'root': root,
+        'db_stat': list(db_stat),
+        'entries': [[entry[field] for field in FIELDS] for entry in entries]
+    }
+    path = snapshot_path(root)
+    temp = path + '.tmp'
+    try:
+        if not os.path.exists(cache_folder()):
+            os.makedirs(cache_folder())
+        with gzip.open(temp, 'wt', encoding='utf-8') as f:
+            json.dump(data, f, separators=(',', ':'))
+        os.replace(temp, path)
+    except (IOError, OSError) as e:
+        util.debug('Unable to save snapshot of %s: %s' % (root, str(e)))
+        return
+    util.debug('Saved snapshot of %s (%d entries) in %.3fs' % (root, len(entries), time.time() - start))
+
+
+def load(root, db_stat):
+    """Reads the snapshot of a working copy, None if it is missing or does not match wc.db"""
+    path = snapshot_path(root)
+    if db_stat is None or not os.path.isfile(path):
+        return None
+    try:
+        with gzip.open(path, 'rt', encoding='utf-8') as f:
+            data = json.load(f)
+    except (IOError, OSError, ValueError) as e:
+        util.debug('Unable to read snapshot of %s: %s' % (root, str(e)))
+        return None
+    if data.get('version') != VERSION or data.get('root') != root:
+        return None
+    if tuple(data.get('db_stat', ())) != tuple(db_stat):
+        util.debug('Snapshot of %s is out of date' % root)
+        return None
+    return [dict(zip(FIELDS, row)) for row in data['entries']]
+
+
+def save_scheduled(root, get_state):
+    """Writes a snapshot that was scheduled"""
+    with Snapshots.lock:
+        Snapshots.pending.discard(root)
+    entries, db_stat = get_state()
+    save(root, entries, db_stat)
+
+
+def schedule_save(root, get_state):
+    """Saves a snapshot in the background after a delay, coalescing repeated requests"""
+    with Snapshots.lock:
+        if root in Snapshots.pending:
+            return
+        Snapshots.pending.add(root)
+    sublime.set_timeout_async(partial(save_scheduled, root, get_state), SAVE_DELAY)
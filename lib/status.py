@@ -0,0 +1,480 @@
+import os
+import threading
+import time
+import xml.etree.ElementTree as ElementTree
+from . import capabilities, command, localstatus, settings, snapshot, thread, trie, util, visibility, watcher, wcdb
+
+ADMIN_DIR = '.svn'
+WC_DB = 'wc.db'
+UNVERSIONED_ITEMS = ('unversioned', 'ignored', 'none')
+CHANGED_ITEMS = (
+    'added',
+    'conflicted',
+    'deleted',
+    'incomplete',
+    'merged',
+    'missing',
+    'modified',
+    'obstructed',
+    'replaced',
+    'unversioned'
+)
+CHANGED_PROPS = ('conflicted', 'modified')
+
+
+def normalize(path):
+    """Normalizes a path so that it can be used as an index key"""
+    return os.path.normcase(os.path.normpath(os.path.abspath(path)))
+
+
+def is_child(path, parent):
+    """Checks if a normalized path is the parent or one of its descendants"""
+    if path == parent:
+        return True
+    if not parent.endswith(os.sep):
+        parent = parent + os.sep
+    return path.startswith(parent)
+
+
+def find_root(path):
+    """Finds the root of the working copy containing the path, None if unversionned"""
+    path = normalize(path)
+    if os.path.isfile(path) or not os.path.exists(path):
+        path = os.path.dirname(path)
+    visited = []
+    root = None
+    current = path
+    while True:
+        cached = WorkingCopy.roots.get(current)
+        if cached is not None:
+            root = cached
+            break
+        visited.append(current)
+        if os.path.isdir(os.path.join(current, ADMIN_DIR)):
+            root = current
+            break
+        parent = os.path.dirname(current)
+        if parent == current:
+            break
+        current = parent
+    if root is not None:
+        for folder in visited:
+            WorkingCopy.roots[folder] = root
+    return root
+
+
+def db_stat(root):
+    """Gets the modification time and size of the database of a working copy"""
+    try:
+        stat = os.stat(os.path.join(root, ADMIN_DIR, WC_DB))
+    except OSError:
+        return None
+    return (stat.st_mtime, stat.st_size)
+
+
+def parse_status(raw):
+    """Parses the output of `svn status --xml --verbose` into index entries"""
+    entries = {}
+    if not raw:
+        return entries
+    try:
+        tree = ElementTree.fromstring(raw.strip())
+    except ElementTree.ParseError as e:
+        util.debug('Unable to parse status: ' + str(e))
+        return entries
+    for node in tree.iter('entry'):
+        status = node.find('wc-status')
+        if status is None:
+            continue
+        entries[normalize(node.get('path'))] = {
+            'path': node.get('path'),
+            'item': status.get('item'),
+            'props': status.get('props'),
+            'revision': status.get('revision'),
+            'tree-conflicted': status.get('tree-conflicted') == 'true',
+            'locked': status.find('lock') is not None,
+            'kind': None
+        }
+    return entries
+
+
+def local_entries(root, paths=None, depth='infinity'):
+    """Gets status entries from the local status engine, None if svn status must be used"""
+    if not settings.get('nativeStatus', default=True):
+        return None
+    result = localstatus.scan(wcdb.get(root), paths, depth)
+    if result is None:
+        return None
+    found, deferred = result
+    entries = {}
+    for path, entry in found:
+        entry['path'] = path
+        entries[normalize(path)] = entry
+    if deferred:
+        p = thread.Process('Status', command.svn('status', '--xml'), deferred, False, False, root=root)
+        entries.update(parse_status(p.output()))
+    return entries
+
+
+def cli_entries(root, paths=None, depth='infinity'):
+    """Gets status entries by running svn status"""
+    # externals are indexed as working copies of their own
+    cmd = command.svn('status', '--xml', '--verbose', '--ignore-externals')
+    if depth != 'infinity':
+        if capabilities.supports('status', '--depth'):
+            cmd.extend(['--depth', depth])
+        else:
+            # clients without --depth only know about recursive and non-recursive
+            cmd.append('--non-recursive')
+    p = thread.Process('Status', cmd, paths or [root], False, False, root=root)
+    return parse_status(p.output())
+
+
+def fetch_entries(root, paths=None, depth='infinity'):
+    """Gets status entries from the local status engine or svn status"""
+    entries = local_entries(root, paths, depth)
+    if entries is None:
+        entries = cli_entries(root, paths, depth)
+    return entries
+
+
+def collapse(paths):
+    """Removes the paths that are below another path of the set"""
+    kept = []
+    for path in sorted(paths):
+        if not kept or not is_child(path, kept[-1]):
+            kept.append(path)
+    return kept
+
+
+def is_entry_changed(entry):
+    """Checks if an index entry would be listed by a plain `svn status`"""
+    return (
+        entry['item'] in CHANGED_ITEMS
+        or entry['props'] in CHANGED_PROPS
+        or entry['tree-conflicted']
+    )
+
+
+class WorkingCopy:
+    """An in-memory index of the status of every path in a working copy"""
+    indexes = {}
+    roots = {}
+    lock = threading.Lock()
+
+    def __init__(self, root):
+        """Initializes a WorkingCopy index"""
+        self.root = root
+        self.trie = trie.Trie(root)
+        self.timestamp = 0
+        self.db_stat = None
+        self.lock = threading.RLock()
+        self.dirty_dirs = set()
+        self.dirty_trees = set()
+        self.dirty_lock = threading.Lock()
+        self.watched = False
+        self.restored = False
+
+    def get(path):
+        """Gets the index for the working copy containing the path"""
+        root = find_root(path)
+        if root is None:
+            return None
+        with WorkingCopy.lock:
+            wc = WorkingCopy.indexes.get(root)
+            if wc is None:
+                wc = WorkingCopy(root)
+                WorkingCopy.indexes[root] = wc
+        wc.ensure_fresh()
+        return wc
+
+    def get_db_stat(self):
+        """Gets the modification time and size of the working copy database"""
+        return db_stat(self.root)
+
+    def is_stale(self):
+        """Checks if the whole index needs to be rebuilt"""
+        if not self.timestamp:
+            return True
+        # a polled working copy does not see files edited in place, so it still expires
+        if not self.watched or not watcher.is_notified(self.root):
+            timeout = settings.get('statusCacheTimeout', default=5)
+            if time.time() - self.timestamp > timeout:
+                return True
+        return self.get_db_stat() != self.db_stat
+
+    def is_dirty(self):
+        """Checks if parts of the index have been marked as changed"""
+        return bool(self.dirty_dirs or self.dirty_trees)
+
+    def ensure_fresh(self):
+        """Rebuilds the index if it is stale, or only its dirty parts"""
+        with self.lock:
+            if not self.timestamp and not self.restored:
+                self.restore()
+            if self.is_stale():
+                self.refresh()
+            elif self.is_dirty():
+                self.refresh_dirty()
+
+    def set_entries(self, entries):
+        """Replaces the entries of the index"""
+        paths = trie.Trie(self.root)
+        for entry in entries:
+            paths.set(entry['path'], entry)
+        self.trie = paths
+
+    def refresh(self):
+        """Fills the index from the local status engine, or a single status command on the working copy root"""
+        with self.dirty_lock:
+            self.dirty_dirs.clear()
+            self.dirty_trees.clear()
+        db_stat = self.get_db_stat()
+        self.set_entries(fetch_entries(self.root).values())
+        self.timestamp = time.time()
+        self.db_stat = db_stat
+        util.debug('Indexed %d entries (%s) in %s' % (len(self.trie), self.describe_counts(), self.root))
+        self.watch()
+        self.save()
+
+    def restore(self):
+        """Fills the index from its on-disk snapshot if it still matches wc.db"""
+        self.restored = True
+        if not settings.get('statusSnapshot', default=True):
+            return
+        db_stat = self.get_db_stat()
+        rows = snapshot.load(self.root, db_stat)
+        if rows is None:
+            return
+        self.set_entries(rows)
+        self.timestamp = time.time()
+        self.db_stat = db_stat
+        util.debug('Restored %d entries from the snapshot of %s' % (len(self.trie), self.root))
+        self.watch()
+        # files edited while the editor was closed do not change wc.db, the snapshot is only served until it is checked
+        worker = threading.Thread(target=self.verify)
+        worker.daemon = True
+        worker.start()
+
+    def verify(self):
+        """Rebuilds an index restored from its snapshot in the background, the snapshot answers queries meanwhile"""
+        with self.dirty_lock:
+            self.dirty_dirs.clear()
+            self.dirty_trees.clear()
+        db_stat = self.get_db_stat()
+        entries = fetch_entries(self.root).values()
+        with self.lock:
+            self.set_entries(entries)
+            self.timestamp = time.time()
+            self.db_stat = db_stat
+        util.debug('Verified the snapshot of %s, %d entries (%s)' % (self.root, len(self.trie), self.describe_counts()))
+        visibility.invalidate()
+        self.save()
+
+    def save(self):
+        """Schedules a snapshot of the index to be written"""
+        if settings.get('statusSnapshot', default=True):
+            snapshot.schedule_save(self.root, self.snapshot_state)
+
+    def snapshot_state(self):
+        """Gets the entries and wc.db stat to write in the snapshot"""
+        with self.lock:
+            return [entry for path, entry in self.trie.items()], self.db_stat
+
+    def describe_counts(self):
+        """Describes the aggregate counters of the whole working copy"""
+        counts = self.trie.counts(self.root)
+        return ', '.join('%d %s' % (count, name) for name, count in zip(trie.COUNTERS, counts))
+
+    def watch(self):
+        """Starts watching the working copy for changes"""
+        if not self.watched:
+            self.watched = watcher.watch(self.root, on_change)
+
+    def refresh_dirty(self):
+        """Refreshes the dirty directories and subtrees of the index"""
+        with self.dirty_lock:
+            trees = collapse(self.dirty_trees)
+            dirs = self.dirty_dirs
+            self.dirty_dirs = set()
+            self.dirty_trees = set()
+        if self.root in trees:
+            self.refresh()
+            return
+        dirs = sorted(d for d in dirs if not any(is_child(d, tree) for tree in trees))
+        found = []
+        if trees:
+            found.extend(fetch_entries(self.root, trees).values())
+        if dirs:
+            found.extend(fetch_entries(self.root, dirs, 'immediates').values())
+        for tree in trees:
+            self.trie.remove(tree)
+        for folder in dirs:
+            self.trie.clear_children(folder)
+        for entry in found:
+            self.trie.set(entry['path'], entry)
+        util.debug('Refreshed %d directories and %d subtrees in %s' % (len(dirs), len(trees), self.root))
+        self.save()
+
+    def mark(self, path, depth):
+        """Marks a path as changed, 'file' refreshes its parent, 'immediates' its children and 'infinity' its subtree"""
+        with self.dirty_lock:
+            if depth == 'infinity':
+                self.dirty_trees.add(path)
+            elif depth == 'immediates':
+                self.dirty_dirs.add(path)
+            elif path == self.root:
+                self.dirty_dirs.add(path)
+            else:
+                self.dirty_dirs.add(os.path.dirname(path))
+                if not os.path.exists(path):
+                    self.dirty_trees.add(path)
+
+    def invalidate(self):
+        """Forces the index to be rebuilt on the next query"""
+        self.timestamp = 0
+
+    def entry(self, path):
+        """Gets the index entry for a path"""
+        return self.trie.get(os.path.abspath(path))
+
+    def is_versionned(self, path):
+        """Checks if a path is versionned"""
+        entry = self.entry(path)
+        return entry is not None and entry['item'] not in UNVERSIONED_ITEMS
+
+    def is_changed(self, path):
+        """Checks if a path, or anything below it, has been changed"""
+        return self.trie.has_changes(os.path.abspath(path))
+
+    def has_conflicts(self, path):
+        """Checks if a path, or anything below it, is conflicted"""
+        return self.trie.has_conflicts(os.path.abspath(path))
+
+    def kind(self, path):
+        """Gets the kind of a path ('file' or 'dir'), remembered after the first lookup"""
+        entry = self.entry(path)
+        if entry is None:
+            return 'file' if os.path.isfile(path) else 'dir'
+        if entry['kind'] is None:
+            entry['kind'] = 'file' if os.path.isfile(path) else 'dir'
+            self.trie.set(entry['path'], entry)
+        return entry['kind']
+
+
+def stop():
+    """Stops watching the working copies and forgets their indexes"""
+    watcher.stop()
+    with WorkingCopy.lock:
+        WorkingCopy.indexes.clear()
+        WorkingCopy.roots.clear()
+
+
+def invalidate(paths=None):
+    """Marks the indexes containing the paths as stale, or all of them if no paths are given"""
+    with WorkingCopy.lock:
+        indexes = list(WorkingCopy.indexes.values())
+    if paths is None:
+        WorkingCopy.roots.clear()
+        for wc in indexes:
+            wc.invalidate()
+        return
+    roots = set(find_root(path) for path in paths)
+    for wc in indexes:
+        if wc.root in roots:
+            wc.invalidate()
+
+
+def mark_dirty(paths, depth='file', own=False):
+    """Marks paths as changed so that only the affected parts of their indexes are refreshed"""
+    for path in paths:
+        root = find_root(path)
+        wc = WorkingCopy.indexes.get(root) if root is not None else None
+        if wc is None:
+            continue
+        path = normalize(path)
+        if depth == 'infinity' and not os.path.isdir(path):
+            wc.mark(path, 'file')
+        else:
+            wc.mark(path, depth)
+        if own:
+            wc.db_stat = wc.get_db_stat()
+    visibility.invalidate()
+
+
+def on_change(path, depth):
+    """Handles a change reported by the file system watcher"""
+    mark_dirty([path], depth)
+
+
+def is_changed(files):
+    """Checks if any of the files have been changed since the last revision"""
+    for f in files:
+        wc = WorkingCopy.get(f)
+        if wc is not None and wc.is_changed(f):
+            return True
+    return False
+
+
+def changes(files):
+    """Gets the (item, path) changes below the files, None if svn status must be used"""
+    found = []
+    groups = {}
+    for f in files:
+        root = find_root(f)
+        if root is None:
+            return None
+        groups.setdefault(root, []).append(f)
+    # one scan per working copy, whatever the number of selected files
+    for root in sorted(groups.keys()):
+        entries = local_entries(root, collapse(normalize(f) for f in groups[root]))
+        if entries is None:
+            return None
+        for key in sorted(entries.keys()):
+            entry = entries[key]
+            if is_entry_changed(entry):
+                found.append((entry['item'], entry['path']))
+    return found
+
+
+def cached_changes(files):
+    """Gets the (item, path) changes known by the indexes in memory, and whether they may be out of date"""
+    found = []
+    outdated = False
+    for f in files:
+        root = find_root(f)
+        wc = WorkingCopy.indexes.get(root) if root is not None else None
+        if wc is None or not wc.timestamp:
+            outdated = True
+            continue
+        if not wc.lock.acquire(False):
+            # the index is being refreshed, its entries are read again once it is done
+            outdated = True
+            continue
+        try:
+            for path, entry in wc.trie.items(os.path.abspath(f), changed_only=True):
+                found.append((entry['item'], path))
+        finally:
+            wc.lock.release()
+        if wc.is_dirty() or wc.is_stale():
+            outdated = True
+    return found, outdated
+
+
+def kind(path):
+    """Gets the kind of a path, using the index when the path is versionned"""
+    root = find_root(path)
+    wc = WorkingCopy.indexes.get(root) if root is not None else None
+    if wc is None:
+        return 'file' if os.path.isfile(path) else 'dir'
+    return wc.kind(path)
+
+
+def is_file(files):
+    """Checks if the list of files is a single file"""
+    return len(files) == 1 and kind(files[0]) == 'file'
+
+
+def is_folder(files):
+    """Checks if the list of files is a single folder"""
+    return len(files) == 1 and kind(files[0]) == 'dir'
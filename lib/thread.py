@@ -1,74 +1,547 @@
 import sublime
+import codecs
+import errno
+import locale
+import os
+import select
+import signal
+import threading
+import time
+from collections import deque
+from functools import partial
 from subprocess import Popen, PIPE
-from threading import Thread, Timer
-from . import output, util
+import subprocess
+from . import command, output, settings, util
 
-TIME_INTERVAL = 0.05
+TIME_INTERVAL = 100
 LOADING_SIZE = 7
+READ_SIZE = 65536
+SELECT_TIMEOUT = 1.0
+EXIT_POLL_TIMEOUT = 0.05
+STDOUT = 'stdout'
+STDERR = 'stderr'
+USER = 0
+BACKGROUND = 1
+DEFAULT_PARALLEL = 4
+# seconds before a process is killed, per svn subcommand, 0 never kills it
+DEFAULT_TIMEOUTS = {
+    'default': 300,
+    'blame': 600,
+    'info': 60,
+    'log': 300,
+    'status': 300
+}
+# milliseconds between asking a process group to stop and killing it
+KILL_GRACE = 2000
 
 
-class Process(Thread):
-    """A threaded process"""
+class Ticker:
+    """Shows the progress of the running commands in the status bar, shared by every process"""
+    running = False
+    loading = 0
+    lock = threading.Lock()
+
+    def start():
+        """Starts the ticker if it is not already running"""
+        with Ticker.lock:
+            if Ticker.running:
+                return
+            Ticker.running = True
+        sublime.set_timeout(Ticker.tick, TIME_INTERVAL)
+
+    def tick():
+        """Updates the status bar while commands are running"""
+        processes = [p for p in Process.running() if p.log]
+        if not processes:
+            with Ticker.lock:
+                Ticker.running = False
+            return
+        message = "Running: " + processes[-1].name
+        if len(processes) > 1:
+            message = message + " (+" + str(len(processes) - 1) + ")"
+        queued = len(Scheduler.queue)
+        if queued > 0:
+            message = message + " (" + str(queued) + " queued)"
+        if LOADING_SIZE > 0:
+            n = abs(Ticker.loading - LOADING_SIZE)
+            message = message + "  [" + " " * (LOADING_SIZE - n) + "=" + " " * n + "]"
+            Ticker.loading = (Ticker.loading + 1) % (LOADING_SIZE * 2)
+        sublime.status_message(message)
+        sublime.set_timeout(Ticker.tick, TIME_INTERVAL)
+
+
+class Scheduler:
+    """Decides when processes start: writes are serialised per working copy and user commands go first"""
+    queue = []
+    running = []
+    writing = set()
+    sequence = 0
+    lock = threading.Lock()
+    started = 0
+    waited = 0
+    coalesced = 0
+
+    def submit(process):
+        """Queues a process, or attaches it to an identical process that is still queued"""
+        with Scheduler.lock:
+            for priority, sequence, queued in Scheduler.queue:
+                if Scheduler.is_same(queued, process):
+                    queued.followers.append(process)
+                    Scheduler.coalesced = Scheduler.coalesced + 1
+                    util.debug('Scheduler: coalesced %s with a queued request' % process.name)
+                    return
+            Scheduler.sequence = Scheduler.sequence + 1
+            Scheduler.queue.append((process.priority, Scheduler.sequence, process))
+            Scheduler.queue.sort(key=lambda entry: entry[:2])
+        Scheduler.dispatch()
+
+    def is_same(queued, process):
+        """Checks if a process can take the results of a queued one: same command, kept output and no streaming"""
+        return (
+            queued.command == process.command and queued.write == process.write
+            and not queued.urgent and not process.urgent
+            and queued.priority == process.priority
+            and queued.retain == process.retain and queued.tail == process.tail
+            and not any((queued.on_output, queued.on_error, queued.on_chunk))
+            and not any((process.on_output, process.on_error, process.on_chunk))
+        )
+
+    def is_blocked(process):
+        """Checks if a write is waiting for another write on the same working copy"""
+        return process.write and any(root in Scheduler.writing for root in process.roots)
+
+    def dispatch():
+        """Starts the queued processes that may run"""
+        limit = max(1, settings.get('parallelCommands', default=DEFAULT_PARALLEL))
+        ready = []
+        with Scheduler.lock:
+            for entry in list(Scheduler.queue):
+                process = entry[2]
+                if Scheduler.is_blocked(process):
+                    continue
+                if len(Scheduler.running) >= limit and not process.urgent:
+                    continue
+                Scheduler.queue.remove(entry)
+                Scheduler.running.append(process)
+                if process.write:
+                    Scheduler.writing.update(process.roots)
+                ready.append(process)
+        for process in ready:
+            Scheduler.started = Scheduler.started + 1
+            wait = time.time() - process.queued_at
+            Scheduler.waited = Scheduler.waited + wait
+            util.debug('Scheduler: starting %s after %.3fs in the queue (%s)' % (process.name, wait, Scheduler.describe()))
+            process.start()
+
+    def release(process):
+        """Frees the place of a completed process and starts the next ones"""
+        with Scheduler.lock:
+            if process not in Scheduler.running:
+                return
+            Scheduler.running.remove(process)
+            if process.write:
+                Scheduler.writing.difference_update(process.roots)
+        Scheduler.dispatch()
+
+    def queued():
+        """Gets the processes waiting in the queue"""
+        with Scheduler.lock:
+            return [entry[2] for entry in Scheduler.queue]
+
+    def cancel(process):
+        """Removes a process from the queue, or from the process it was coalesced with, True if it had not started"""
+        with Scheduler.lock:
+            for entry in Scheduler.queue:
+                if entry[2] is process:
+                    Scheduler.queue.remove(entry)
+                    return True
+            for leader in [entry[2] for entry in Scheduler.queue] + Scheduler.running:
+                if process in leader.followers:
+                    leader.followers.remove(process)
+                    return True
+        return False
+
+    def describe():
+        """Describes the queue depth and wait times for debugging"""
+        average = Scheduler.waited / Scheduler.started if Scheduler.started else 0
+        return '%d queued, %d running, %d coalesced, %.3fs average wait' % (
+            len(Scheduler.queue), len(Scheduler.running), Scheduler.coalesced, average
+        )
+
+
+class Loop(threading.Thread):
+    """Reads the output of every running process on a single thread"""
+    instance = None
+    lock = threading.Lock()
+
+    def get():
+        """Gets the shared loop, starting it the first time"""
+        with Loop.lock:
+            if Loop.instance is None:
+                Loop.instance = Loop()
+                Loop.instance.start()
+            return Loop.instance
+
+    def stop():
+        """Stops the shared loop, the next process starts a new one"""
+        with Loop.lock:
+            loop = Loop.instance
+            Loop.instance = None
+        if loop is not None:
+            loop.running = False
+            os.write(loop.wake_write, b'.')
+
+    def __init__(self):
+        """Initializes the Loop"""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.streams = {}
+        self.exiting = []
+        self.streams_lock = threading.Lock()
+        self.wake_read, self.wake_write = os.pipe()
+        self.running = True
+
+    def add(self, process):
+        """Starts reading the output of a process"""
+        with self.streams_lock:
+            self.streams[process.process.stdout.fileno()] = (process, STDOUT, process.process.stdout)
+            self.streams[process.process.stderr.fileno()] = (process, STDERR, process.process.stderr)
+        os.write(self.wake_write, b'.')
+
+    def read(self, fd):
+        """Reads from a readable stream, closing it at the end of the stream"""
+        process, name, pipe = self.streams[fd]
+        try:
+            data = os.read(fd, READ_SIZE)
+        except OSError:
+            data = b''
+        if data:
+            process.feed(name, data)
+            return
+        with self.streams_lock:
+            del self.streams[fd]
+        pipe.close()
+        if process.close_stream(name):
+            self.exiting.append(process)
+
+    def reap(self):
+        """Completes the processes whose streams are closed once they have exited"""
+        for process in list(self.exiting):
+            if process.process.poll() is not None:
+                self.exiting.remove(process)
+                try:
+                    process.finish()
+                except Exception as e:
+                    util.debug('Unable to complete %s: %s' % (process.command, str(e)))
+                    # callers waiting for the results must not wait forever
+                    process.finished.set()
+
+    def run(self):
+        """Waits for output from any of the processes until stopped"""
+        while self.running:
+            with self.streams_lock:
+                fds = list(self.streams.keys())
+            timeout = EXIT_POLL_TIMEOUT if self.exiting else SELECT_TIMEOUT
+            try:
+                readable = select.select(fds + [self.wake_read], [], [], timeout)[0]
+            except (OSError, select.error) as e:
+                if getattr(e, 'errno', None) == errno.EINTR or (e.args and e.args[0] == errno.EINTR):
+                    continue
+                util.debug('Process loop error: ' + str(e))
+                readable = []
+            for fd in readable:
+                if fd == self.wake_read:
+                    os.read(self.wake_read, READ_SIZE)
+                    continue
+                with self.streams_lock:
+                    process = self.streams[fd][0]
+                try:
+                    self.read(fd)
+                except Exception as e:
+                    # an error in the handlers of one process must not stop the loop shared by every process
+                    process.fail(e)
+                    with self.streams_lock:
+                        reading = any(stream[0] is process for stream in self.streams.values())
+                    if not reading and process not in self.exiting:
+                        self.exiting.append(process)
+            self.reap()
+        os.close(self.wake_read)
+        os.close(self.wake_write)
+
+
+def read_pipe(process, name, pipe):
+    """Reads a single stream of a process until its end, used where pipes can not be selected"""
+    while True:
+        try:
+            data = os.read(pipe.fileno(), READ_SIZE)
+        except OSError:
+            data = b''
+        if not data:
+            break
+        try:
+            process.feed(name, data)
+        except Exception as e:
+            process.fail(e)
+    pipe.close()
+    if process.close_stream(name):
+        process.process.wait()
+        process.finish()
+
+
+class Process:
+    """A process whose output is read by the shared process loop"""
     active_processes = []
+    lock = threading.Lock()
 
-    def __init__(self, name, cmd, paths=None, log=True, async=False, on_complete=None, interactive=False):
-        """Initializes a Process object"""
-        Thread.__init__(self)
+    def __init__(
+        self, name, cmd, paths=None, log=True, async=False, on_complete=None, interactive=False,
+        on_output=None, on_error=None, on_chunk=None, retain=True, tail=0,
+        priority=None, root=None, write=False
+    ):
+        """Initializes a Process object, keeping only the last `tail` lines of each stream unless retain is set"""
         self.name = name
         self.cmd = cmd
         self.paths = paths
         self.async = async
         self.done = False
+        self.cancelled = False
+        self.deadline = None
         self.log = log
-        self.lines = []
+        self.retain = retain
+        self.tail = tail
+        self.lines = [] if retain else deque(maxlen=tail)
+        self.errors = [] if retain else deque(maxlen=tail)
+        self.error_count = 0
+        self.timeline = []
         self.output_text = None
         self.error_text = None
-        self.timer = None
-        self.loading = 0
         self.returncode = None
         self.on_complete = on_complete
-        if not paths:
-            if interactive:
-                self.command = cmd
+        self.finished = threading.Event()
+        self.encoding = locale.getpreferredencoding(False)
+        self.decoders = {}
+        self.pending = {STDOUT: '', STDERR: ''}
+        self.open_streams = 2
+        self.streams_lock = threading.Lock()
+        self.on_output = on_output
+        self.on_error = on_error
+        self.on_chunk = on_chunk
+        self.process = None
+        self.priority = priority if priority is not None else (USER if log else BACKGROUND)
+        self.roots = [] if root is None else (list(root) if isinstance(root, (list, tuple, set)) else [root])
+        self.write = write
+        # a synchronous process on the main thread would freeze the interface while queued
+        self.urgent = not async and threading.current_thread().name == 'MainThread'
+        self.followers = []
+        self.result = None
+        self.queued_at = time.time()
+        self.started = False
+        self.started_at = None
+        self.finished_at = None
+        # the output goes to the window the command was started from, even if another one is active when it runs
+        self.section = output.Section(name) if log else None
+        if log and on_output is None:
+            self.on_output = lambda line: output.add_result_message(self.section, line.strip('\r\n'))
+        if log and on_error is None:
+            self.on_error = lambda line: output.add_error_message(self.section, line.strip('\r\n'))
+        self.interactive = interactive
+        self.timed_out = False
+        self.args, self.targets = self.build(cmd, paths, interactive)
+        self.command = command.quote(self.args)
+        util.debug(self.command)
+        Scheduler.submit(self)
+        if not self.async:
+            self.wait()
+
+    def build(self, cmd, paths, interactive):
+        """Builds the argument list the process runs, and the targets file to remove once it completes"""
+        return command.build(cmd, paths, interactive)
+
+    def running():
+        """Gets the processes that are still running"""
+        with Process.lock:
+            return list(Process.active_processes)
+
+    def start(self):
+        """Starts the process in a process group of its own and hands its streams to the loop"""
+        if self.cancelled:
+            # cancelled while it was being dispatched
+            self.complete()
+            return
+        self.begin()
+        try:
+            if os.name == 'nt':
+                self.process = Popen(self.args, stdout=PIPE, stderr=PIPE, creationflags=subprocess.CREATE_NEW_PROCESS_GROUP)
             else:
-                self.command = cmd + ' --non-interactive'
+                self.process = Popen(self.args, stdout=PIPE, stderr=PIPE, start_new_session=True)
+        except OSError as e:
+            # without a shell, a missing program fails here instead of exiting with an error code
+            self.returncode = -1
+            self.add_line(STDERR, 'Unable to run ' + self.args[0] + ': ' + str(e) + '\n')
+            self.finish()
+            return
+        if os.name == 'nt':
+            # select only works with sockets on Windows, each stream gets a blocking reader
+            for name, pipe in ((STDOUT, self.process.stdout), (STDERR, self.process.stderr)):
+                reader = threading.Thread(target=read_pipe, args=(self, name, pipe))
+                reader.daemon = True
+                reader.start()
         else:
-            if interactive:
-                self.command = cmd + ' ' + self.get_path(paths)
+            Loop.get().add(self)
+        timeout = self.get_timeout()
+        if timeout > 0:
+            # the async thread may itself be waiting for this process
+            self.deadline = threading.Timer(timeout, self.expire)
+            self.deadline.daemon = True
+            self.deadline.start()
+        if self.cancelled:
+            self.kill()
+
+    def begin(self):
+        """Writes the header of the command and counts it as running"""
+        if self.log:
+            output.add_command(self.section, self.command)
+            output.add_files(self.section, self.paths)
+            output.add_result_section(self.section)
+        self.started = True
+        self.started_at = time.time()
+        with Process.lock:
+            Process.active_processes.append(self)
+        if self.log:
+            Ticker.start()
+
+    def get_timeout(self):
+        """Gets the number of seconds the process may run, interactive processes like diff tools are never killed"""
+        if self.interactive:
+            return 0
+        timeouts = settings.get('commandTimeouts', default={}) or {}
+        name = command.subcommand(self.args)
+        timeout = timeouts.get(name, DEFAULT_TIMEOUTS.get(name))
+        # killing a write would leave the working copy locked or half changed, it only times out if the setting names it
+        if timeout is None and (self.write or name in command.WRITE_SUBCOMMANDS):
+            return 0
+        if timeout is None:
+            timeout = timeouts.get('default', DEFAULT_TIMEOUTS['default'])
+        return timeout or 0
+
+    def expire(self):
+        """Kills the process if it is still running once its timeout has passed"""
+        if self.done:
+            return
+        self.timed_out = True
+        self.add_line(STDERR, 'Timed out after %ss\n' % self.get_timeout())
+        self.terminate()
+
+    def kill(self):
+        """Kills the process and every process it started"""
+        if self.process is None or self.process.poll() is not None:
+            return
+        try:
+            if os.name == 'nt':
+                Popen(['taskkill', '/F', '/T', '/PID', str(self.process.pid)], stdout=PIPE, stderr=PIPE)
             else:
-                self.command = cmd + ' --non-interactive ' + self.get_path(paths)
-        if log:
-            output.add_command(self.name, self.command)
-            output.add_files(self.paths)
-            output.add_result_section()
-        util.debug(self.command)
-        if self.async:
-            self.start()
-        else:
-            self.run()
+                os.killpg(self.process.pid, signal.SIGTERM)
+                timer = threading.Timer(KILL_GRACE / 1000, self.force_kill)
+                timer.daemon = True
+                timer.start()
+        except OSError as e:
+            util.debug('Unable to kill %s: %s' % (self.command, str(e)))
 
-    def run(self):
-        """Runs the process"""
-        self.process = Popen(self.command, stdout=PIPE, stderr=PIPE, shell=True, universal_newlines=True)
-        Process.active_processes.append(self)
-        for line in self.process.stdout:
-            self.lines.append(line)
-            if self.log:
-                output.add_result_message(line.strip('\r\n'))
-        self.output_text = "\n".join(self.lines)
-        self.error_text = self.process.stderr.read()
-        self.process.communicate()
-        self.complete()
+    def force_kill(self):
+        """Kills what is left of the process group"""
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def fail(self, error):
+        """Stops handing the output of the process to its handlers after one of them failed, and kills it"""
+        util.debug('Unable to handle the output of %s: %s' % (self.command, str(error)))
+        self.on_output = None
+        self.on_error = None
+        self.on_chunk = None
+        with self.streams_lock:
+            self.errors.append('Unable to handle the output: ' + str(error) + '\n')
+            self.error_count = self.error_count + 1
+        # the streams are still read to their end, the process is completed once it has exited
+        self.kill()
+
+    def elapsed(self):
+        """Gets the number of seconds the process has been running, or waiting in the queue"""
+        return time.time() - (self.started_at or self.queued_at)
+
+    def wait(self):
+        """Waits for the process to complete, for callers that need its results right away"""
+        self.finished.wait()
+        if self.on_complete is not None:
+            self.on_complete(self)
 
-    def get_path(self, paths):
-        """Gets path for command arguments"""
-        path = None
-        if paths:
-            path = '"' + '" "'.join(paths) + '"'
+    def feed(self, name, data):
+        """Handles data read from one of the streams of the process"""
+        decoder = self.decoders.get(name)
+        if decoder is None:
+            decoder = codecs.getincrementaldecoder(self.encoding)('replace')
+            self.decoders[name] = decoder
+        text = decoder.decode(data)
+        if self.on_chunk is not None:
+            self.on_chunk(name, text)
+        self.receive(name, text)
+
+    def receive(self, name, text):
+        """Splits decoded text into lines, keeping the incomplete last line for later"""
+        text = self.pending[name] + text
+        if text.endswith('\r'):
+            # the \n of a \r\n may be in the next chunk
+            self.pending[name] = '\r'
+            text = text[:-1]
         else:
-            view = sublime.active_window().active_view()
-            path = view.file_name() if view else None
-        return path
+            self.pending[name] = ''
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+        lines = text.split('\n')
+        self.pending[name] = lines.pop() + self.pending[name]
+        for line in lines:
+            self.add_line(name, line + '\n')
+
+    def add_line(self, name, line):
+        """Handles a complete line from one of the streams, remembering when it arrived"""
+        lines = self.errors if name == STDERR else self.lines
+        with self.streams_lock:
+            if name == STDERR:
+                self.error_count = self.error_count + 1
+            if self.retain:
+                self.timeline.append((time.time(), name, len(lines)))
+            lines.append(line)
+        callback = self.on_error if name == STDERR else self.on_output
+        if callback is not None:
+            callback(line)
+
+    def interleaved(self):
+        """Gets the (timestamp, stream, line) of every line of stdout and stderr in the order they were read, if they are retained"""
+        with self.streams_lock:
+            timeline = list(self.timeline)
+        return [(at, name, (self.errors if name == STDERR else self.lines)[index]) for at, name, index in timeline]
+
+    def close_stream(self, name):
+        """Handles the end of a stream, returns True once every stream is closed"""
+        decoder = self.decoders.get(name)
+        rest = self.pending[name] + (decoder.decode(b'', True) if decoder is not None else '')
+        self.pending[name] = ''
+        rest = rest.replace('\r\n', '\n').replace('\r', '\n')
+        if rest:
+            lines = rest.split('\n')
+            for line in lines[:-1]:
+                self.add_line(name, line + '\n')
+            if lines[-1]:
+                self.add_line(name, lines[-1])
+        with self.streams_lock:
+            self.open_streams = self.open_streams - 1
+            return self.open_streams == 0
+
+    def finish(self):
+        """Collects the results of the exited process"""
+        self.output_text = "".join(self.lines)
+        self.error_text = "".join(self.errors)
+        self.complete()
 
     def complete(self):
         """Handles the complete signal from a process"""
@@ -76,29 +549,39 @@ class Process(Thread):
             return
         util.debug(self.command + " DONE")
         self.done = True
-        self.returncode = self.process.returncode
-        if self in Process.active_processes:
-            Process.active_processes.remove(self)
-        if self.log:
-            output.add_error(self.error(), self.process.returncode)
-            output.end_command()
-        if self.on_complete is not None:
-            self.on_complete(self)
-
-    def check_status(self):
-        """Checks the status of a running process"""
-        if self not in Process.active_processes:
-            return
-        if self.done:
+        if self.deadline is not None:
+            self.deadline.cancel()
+        self.finished_at = time.time()
+        command.remove_targets(self.targets)
+        if self.process is not None:
+            self.returncode = self.process.returncode
+        with Process.lock:
+            if self in Process.active_processes:
+                Process.active_processes.remove(self)
+        Scheduler.release(self)
+        if self.log and self.started:
+            if self.error_count > 0:
+                # the error lines have already been added next to the output
+                output.add_error_section(self.section, self.returncode)
+            output.end_command(self.section)
             sublime.status_message("Complete: " + self.name)
-        else:
-            if LOADING_SIZE > 0:
-                n = abs(self.loading - LOADING_SIZE)
-                sublime.status_message("Running: " + self.name + "  [" + " " * (LOADING_SIZE - n) + "=" + " " * n + "]")
-                self.loading = (self.loading + 1) % (LOADING_SIZE * 2)
+        for follower in self.followers:
+            follower.share(self)
+        if self.async and self.on_complete is not None:
+            # callbacks may start processes of their own, they must not run on the loop
+            sublime.set_timeout_async(partial(self.on_complete, self), 0)
+        self.finished.set()
 
-            self.timer = Timer(TIME_INTERVAL, self.check_status)
-            self.timer.start()
+    def share(self, leader):
+        """Completes a coalesced process with the results of the process it was attached to"""
+        self.lines = leader.lines
+        self.errors = leader.errors
+        self.output_text = leader.output_text
+        self.error_text = leader.error_text
+        self.process = leader.process
+        self.returncode = leader.returncode
+        self.log = False
+        self.complete()
 
     def output(self):
         """Get output from the process"""
@@ -109,13 +592,19 @@ class Process(Thread):
         return self.error_text
 
     def terminate(self):
-        """Terminates the process"""
-        if not self.done:
-            self.process.terminate()
-        self.complete()
+        """Cancels the process if it is queued, or kills it with everything it started"""
+        if self.done or self.cancelled:
+            return
+        self.cancelled = True
+        if Scheduler.cancel(self):
+            self.complete()
+            return
+        # the process completes, and frees its place and working copies, once it has exited
+        self.kill()
 
 
 def terminate_all():
-    """Terminates all active processes"""
-    for proc in Process.active_processes:
+    """Cancels the queued processes, then kills the running ones"""
+    # the queue goes first, or killing a process would start the next one
+    for proc in Scheduler.queued() + Process.running():
         proc.terminate()
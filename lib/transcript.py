@@ -0,0 +1,124 @@
+import sublime
+import mmap
+import os
+import threading
+from . import settings, util
+
+FOLDER = 'transcripts'
+FILE_NAME = 'output'
+# megabytes written to a transcript before it is rotated
+DEFAULT_SIZE = 5
+DEFAULT_FILES = 5
+SECTION_MARK = 'Command: '
+
+
+class Transcript:
+    """Serialises the writes to the transcript files"""
+    lock = threading.Lock()
+
+
+def folder():
+    """Gets the folder where the transcripts are written"""
+    return os.path.join(sublime.packages_path(), 'User', 'HypnotoadSVN', FOLDER)
+
+
+def log_path(index=0):
+    """Gets the path of a transcript, 0 being the one written to"""
+    if index == 0:
+        return os.path.join(folder(), FILE_NAME + '.log')
+    return os.path.join(folder(), FILE_NAME + '.' + str(index) + '.log')
+
+
+def paths():
+    """Gets the existing transcripts, newest first"""
+    found = []
+    for index in range(max(1, settings.get_native('outputLogFiles', DEFAULT_FILES))):
+        path = log_path(index)
+        if os.path.exists(path):
+            found.append(path)
+    return found
+
+
+def rotate(files):
+    """Moves every transcript one place back, dropping the oldest"""
+    oldest = log_path(files - 1)
+    if os.path.exists(oldest):
+        os.remove(oldest)
+    for index in range(files - 2, -1, -1):
+        if os.path.exists(log_path(index)):
+            os.replace(log_path(index), log_path(index + 1))
+
+
+def find_section(text):
+    """Finds where the first command starts in text, None if there is none"""
+    if text.startswith(SECTION_MARK):
+        return 0
+    found = text.find('\n' + SECTION_MARK)
+    return found + 1 if found >= 0 else None
+
+
+def append(path, text):
+    """Appends text to a transcript"""
+    if not text:
+        return
+    with open(path, 'ab') as f:
+        f.write(text.encode('utf-8'))
+
+
+def write(text):
+    """Appends output to the transcript, rotating it between two commands once it is full"""
+    files = settings.get_native('outputLogFiles', DEFAULT_FILES)
+    if files <= 0:
+        return
+    limit = settings.get_native('outputLogSize', DEFAULT_SIZE) * 1024 * 1024
+    text = text + '\n'
+    with Transcript.lock:
+        try:
+            if not os.path.exists(folder()):
+                os.makedirs(folder())
+            path = log_path()
+            size = os.path.getsize(path) if os.path.exists(path) else 0
+            split = find_section(text)
+            if size > 0 and size + len(text) > limit and split is not None:
+                append(path, text[:split])
+                rotate(files)
+                text = text[split:]
+            append(path, text)
+        except (IOError, OSError) as e:
+            util.debug('Unable to write the output transcript: ' + str(e))
+
+
+def sections(path):
+    """Finds the (start, end, title) of each command in a transcript, without reading it whole"""
+    mark = ('\n' + SECTION_MARK).encode('utf-8')
+    try:
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return []
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                starts = [0]
+                found = data.find(mark)
+                while found >= 0:
+                    starts.append(found + 1)
+                    found = data.find(mark, found + 1)
+                ends = starts[1:] + [len(data)]
+                found = []
+                for start, end in zip(starts, ends):
+                    line = data.find(b'\n', start, end)
+                    title = data[start:line if line >= 0 else end].decode('utf-8', 'replace')
+                    found.append((start, end, title))
+                return found
+    except (IOError, OSError, ValueError) as e:
+        util.debug('Unable to read the output transcript: ' + str(e))
+        return []
+
+
+def read(path, start, end):
+    """Reads a single section of a transcript"""
+    try:
+        with open(path, 'rb') as f:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                return data[start:end].decode('utf-8', 'replace')
+    except (IOError, OSError, ValueError) as e:
+        util.debug('Unable to read the output transcript: ' + str(e))
+        return None
@@ -0,0 +1,261 @@
+import os
+import sys
+
+ITEMS = (
+    'normal', 'added', 'conflicted', 'deleted', 'external', 'ignored', 'incomplete',
+    'merged', 'missing', 'modified', 'none', 'obstructed', 'replaced', 'unversioned'
+)
+PROPS = ('none', 'normal', 'conflicted', 'modified')
+KINDS = (None, 'file', 'dir')
+ITEM_CODES = dict((item, code) for code, item in enumerate(ITEMS))
+PROP_CODES = dict((props, code) for code, props in enumerate(PROPS))
+KIND_CODES = dict((kind, code) for code, kind in enumerate(KINDS))
+
+# Aggregate counters kept for every subtree
+MODIFIED = 0
+ADDED = 1
+CONFLICTED = 2
+UNVERSIONED = 3
+LOCKED = 4
+COUNTERS = ('modified', 'added', 'conflicted', 'unversioned', 'locked')
+NO_COUNTS = (0, 0, 0, 0, 0)
+CHANGE_COUNTERS = (MODIFIED, ADDED, CONFLICTED, UNVERSIONED)
+MODIFIED_ITEMS = ('deleted', 'incomplete', 'merged', 'missing', 'modified', 'obstructed', 'replaced')
+
+# Layout of the packed state of a node
+PROPS_SHIFT = 4
+TREE_CONFLICT_FLAG = 1 << 6
+LOCKED_FLAG = 1 << 7
+KIND_SHIFT = 8
+
+
+def pack(entry):
+    """Packs a status entry into an integer"""
+    state = ITEM_CODES.get(entry['item'], 0)
+    state = state | PROP_CODES.get(entry['props'], 0) << PROPS_SHIFT
+    state = state | KIND_CODES.get(entry.get('kind'), 0) << KIND_SHIFT
+    if entry.get('tree-conflicted'):
+        state = state | TREE_CONFLICT_FLAG
+    if entry.get('locked'):
+        state = state | LOCKED_FLAG
+    return state
+
+
+def unpack(state, revision, path):
+    """Unpacks the state of a node into a status entry"""
+    return {
+        'path': path,
+        'item': ITEMS[state & 0xF],
+        'props': PROPS[(state >> PROPS_SHIFT) & 0x3],
+        'revision': str(revision) if revision is not None else None,
+        'tree-conflicted': bool(state & TREE_CONFLICT_FLAG),
+        'locked': bool(state & LOCKED_FLAG),
+        'kind': KINDS[(state >> KIND_SHIFT) & 0x3]
+    }
+
+
+def counts_of(state):
+    """Gets the counters a single packed state contributes to"""
+    if state is None:
+        return NO_COUNTS
+    item = ITEMS[state & 0xF]
+    props = PROPS[(state >> PROPS_SHIFT) & 0x3]
+    counts = [0, 0, 0, 0, 0]
+    if item in MODIFIED_ITEMS or props == 'modified':
+        counts[MODIFIED] = 1
+    if item == 'added':
+        counts[ADDED] = 1
+    if item == 'conflicted' or props == 'conflicted' or state & TREE_CONFLICT_FLAG:
+        counts[CONFLICTED] = 1
+    if item == 'unversioned':
+        counts[UNVERSIONED] = 1
+    if state & LOCKED_FLAG:
+        counts[LOCKED] = 1
+    return tuple(counts)
+
+
+# A node costs about 130 bytes with its share of the parent's dictionary, names are interned
+# so repeated components are stored once: one million entries take roughly 130 MiB
+class Node:
+    """A node of the path trie"""
+    __slots__ = ('children', 'state', 'revision', 'counts', 'name')
+
+    def __init__(self, name=None):
+        """Initializes a Node"""
+        self.children = None
+        self.state = None
+        self.revision = None
+        self.counts = None
+        self.name = name
+
+
+class Trie:
+    """Status entries of a working copy stored by path component, with aggregates for every subtree"""
+
+    def __init__(self, root):
+        """Initializes the Trie for a working copy root"""
+        self.root_path = root
+        self.root = Node()
+        self.size = 0
+
+    def __len__(self):
+        """Gets the number of entries in the Trie"""
+        return self.size
+
+    def split(self, path):
+        """Splits an absolute path into the components below the root"""
+        rel = os.path.relpath(path, self.root_path)
+        if rel == os.curdir:
+            return []
+        return rel.split(os.sep)
+
+    def walk(self, path):
+        """Gets the nodes from the root to a path, None if the path is not in the Trie"""
+        node = self.root
+        nodes = [node]
+        for part in self.split(path):
+            if node.children is None:
+                return None
+            node = node.children.get(os.path.normcase(part))
+            if node is None:
+                return None
+            nodes.append(node)
+        return nodes
+
+    def adjust(self, nodes, delta):
+        """Adds a counter delta to each of the nodes"""
+        if delta == NO_COUNTS:
+            return
+        for node in nodes:
+            counts = node.counts or NO_COUNTS
+            counts = tuple(a + b for a, b in zip(counts, delta))
+            node.counts = counts if counts != NO_COUNTS else None
+
+    def set(self, path, entry):
+        """Stores the status entry of a path, ignoring paths outside of the root"""
+        parts = self.split(path)
+        if parts and parts[0] == os.pardir:
+            return
+        node = self.root
+        nodes = [node]
+        for part in parts:
+            key = sys.intern(os.path.normcase(part))
+            if node.children is None:
+                node.children = {}
+            child = node.children.get(key)
+            if child is None:
+                child = Node(sys.intern(part) if part != key else None)
+                node.children[key] = child
+            node = child
+            nodes.append(node)
+        old = counts_of(node.state)
+        if node.state is None:
+            self.size = self.size + 1
+        node.state = pack(entry)
+        revision = entry.get('revision')
+        node.revision = int(revision) if revision is not None else None
+        new = counts_of(node.state)
+        self.adjust(nodes, tuple(b - a for a, b in zip(old, new)))
+
+    def get(self, path):
+        """Gets the status entry of a path, None if it is not in the Trie"""
+        nodes = self.walk(path)
+        if nodes is None or nodes[-1].state is None:
+            return None
+        node = nodes[-1]
+        return unpack(node.state, node.revision, path)
+
+    def prune(self, path, nodes):
+        """Removes the empty nodes at the end of a path"""
+        parts = self.split(path)
+        while len(nodes) > 1:
+            node = nodes.pop()
+            if node.state is not None or node.children:
+                break
+            del nodes[-1].children[os.path.normcase(parts[len(nodes) - 1])]
+            if not nodes[-1].children:
+                nodes[-1].children = None
+
+    def clear(self, path):
+        """Removes the entry of a path, keeping the entries below it"""
+        nodes = self.walk(path)
+        if nodes is None or nodes[-1].state is None:
+            return
+        node = nodes[-1]
+        self.adjust(nodes, tuple(-c for c in counts_of(node.state)))
+        node.state = None
+        node.revision = None
+        self.size = self.size - 1
+        self.prune(path, nodes)
+
+    def clear_children(self, path):
+        """Removes the entries of a path and of its direct children"""
+        nodes = self.walk(path)
+        if nodes is None:
+            return
+        children = nodes[-1].children or {}
+        for key, child in list(children.items()):
+            self.clear(os.path.join(path, child.name or key))
+        self.clear(path)
+
+    def remove(self, path):
+        """Removes the entries of a path and of everything below it"""
+        nodes = self.walk(path)
+        if nodes is None:
+            return
+        if len(nodes) == 1:
+            self.root = Node()
+            self.size = 0
+            return
+        node = nodes[-1]
+        self.adjust(nodes[:-1], tuple(-c for c in (node.counts or NO_COUNTS)))
+        self.size = self.size - sum(1 for n in self.iter_nodes(node) if n.state is not None)
+        parts = self.split(path)
+        parent = nodes[-2]
+        del parent.children[os.path.normcase(parts[-1])]
+        if not parent.children:
+            parent.children = None
+        self.prune(os.path.dirname(path), nodes[:-1])
+
+    def iter_nodes(self, node):
+        """Iterates over a node and every node below it"""
+        stack = [node]
+        while stack:
+            node = stack.pop()
+            yield node
+            if node.children:
+                stack.extend(node.children.values())
+
+    def counts(self, path):
+        """Gets the aggregate counters of everything at or below a path"""
+        nodes = self.walk(path)
+        if nodes is None:
+            return NO_COUNTS
+        return nodes[-1].counts or NO_COUNTS
+
+    def has_changes(self, path):
+        """Checks if anything at or below a path has been changed"""
+        counts = self.counts(path)
+        return any(counts[counter] for counter in CHANGE_COUNTERS)
+
+    def has_conflicts(self, path):
+        """Checks if anything at or below a path is conflicted"""
+        return self.counts(path)[CONFLICTED] > 0
+
+    def items(self, path=None, changed_only=False):
+        """Iterates over the (path, entry) pairs at or below a path, optionally only the changed ones"""
+        start = self.root_path if path is None else path
+        nodes = self.walk(start)
+        if nodes is None:
+            return
+        stack = [(start, nodes[-1])]
+        while stack:
+            current, node = stack.pop()
+            if changed_only and not (node.counts and any(node.counts[c] for c in CHANGE_COUNTERS)):
+                continue
+            if node.state is not None:
+                if not changed_only or any(counts_of(node.state)[c] for c in CHANGE_COUNTERS):
+                    yield current, unpack(node.state, node.revision, current)
+            if node.children:
+                for key, child in node.children.items():
+                    stack.append((os.path.join(current, child.name or key), child))
@@ -0,0 +1,111 @@
+import threading
+import time
+from functools import partial
+from . import settings, util
+
+MENU_GAP = 0.5
+MAX_RESULTS = 1000
+
+
+class Visibility:
+    """Remembers the svn test results used to decide command visibility"""
+    results = {}
+    pending = {}
+    lock = threading.Lock()
+    last_check = 0
+    spent = 0
+    generation = 0
+    budget_hits = 0
+    # the files whose budget hit has been counted for the current menu open
+    counted = set()
+
+    def store(uid, tests):
+        """Stores the test results for a set of files"""
+        with Visibility.lock:
+            if uid not in Visibility.results and len(Visibility.results) >= MAX_RESULTS:
+                oldest = min(Visibility.results, key=lambda key: Visibility.results[key][1])
+                del Visibility.results[oldest]
+            Visibility.results[uid] = (tests, time.time())
+
+    def refresh(uid, files, compute):
+        """Starts a background refresh of the test results for a set of files, returns the event set once it is done"""
+        with Visibility.lock:
+            done = Visibility.pending.get(uid)
+            if done is not None:
+                return done
+            done = threading.Event()
+            Visibility.pending[uid] = done
+        # the checks wait for svn, they must not hold up the async thread or the interface
+        worker = threading.Thread(target=partial(Visibility.revalidate, uid, files, compute, done))
+        worker.daemon = True
+        worker.start()
+        return done
+
+    def revalidate(uid, files, compute, done):
+        """Computes the test results in the background"""
+        try:
+            Visibility.store(uid, compute(files))
+        finally:
+            with Visibility.lock:
+                Visibility.pending.pop(uid, None)
+            done.set()
+
+    def begin_check():
+        """Starts a new latency budget if this check belongs to a new menu open"""
+        now = time.time()
+        if now - Visibility.last_check > MENU_GAP:
+            Visibility.spent = 0
+            Visibility.generation = Visibility.generation + 1
+            Visibility.counted = set()
+        Visibility.last_check = now
+
+    def within_budget():
+        """Checks if the current menu open may still block to compute results"""
+        budget = settings.get('visibilityBudget', default=250)
+        return budget <= 0 or Visibility.spent * 1000 < budget
+
+    def remaining():
+        """Gets the seconds the current menu open may still wait, None if there is no budget"""
+        budget = settings.get('visibilityBudget', default=250)
+        if budget <= 0:
+            return None
+        return max(0, budget / 1000 - Visibility.spent)
+
+
+def svn_tests(files, compute):
+    """Gets the svn test results without blocking past the latency budget, unknown results are left out"""
+    uid = "*".join(files)
+    Visibility.begin_check()
+    known = Visibility.results.get(uid)
+    if known is not None and time.time() - known[1] <= settings.get('statusCacheTimeout', default=5):
+        return known[0]
+    mode = settings.get('visibilityChecks', default='blocking')
+    if mode == 'blocking':
+        if Visibility.within_budget():
+            start = time.time()
+            done = Visibility.refresh(uid, files, compute)
+            # a single check can take much longer than the budget, it is left to finish in the background
+            finished = done.wait(Visibility.remaining())
+            Visibility.spent = Visibility.spent + time.time() - start
+            Visibility.last_check = time.time()
+            if finished:
+                found = Visibility.results.get(uid)
+                if found is not None:
+                    return found[0]
+            known = Visibility.results.get(uid, known)
+        # every command of a menu asks for the same files, a menu open is counted once
+        if uid not in Visibility.counted:
+            Visibility.counted.add(uid)
+            Visibility.budget_hits = Visibility.budget_hits + 1
+            util.debug('Visibility budget exceeded (%d times), using %s results' % (
+                Visibility.budget_hits, 'stale' if known is not None else 'permissive'
+            ))
+    Visibility.refresh(uid, files, compute)
+    return known[0] if known is not None else {}
+
+
+def invalidate():
+    """Marks all of the remembered test results as stale so that they are revalidated"""
+    with Visibility.lock:
+        for uid, result in Visibility.results.items():
+            Visibility.results[uid] = (result[0], 0)
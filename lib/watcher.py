@@ -0,0 +1,307 @@
+import ctypes
+import ctypes.util
+import errno
+import os
+import select
+import struct
+import threading
+import time
+from . import settings, util
+
+ADMIN_DIR = '.svn'
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (
+    IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+    | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+)
+NEW_DIR_MASK = IN_CREATE | IN_MOVED_TO
+EVENT_HEADER = struct.Struct('iIII')
+READ_SIZE = 65536
+SELECT_TIMEOUT = 1.0
+
+
+def load_inotify():
+    """Loads the inotify functions from libc, None if they are not available"""
+    if not hasattr(os, 'uname') or os.uname()[0] != 'Linux':
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    libc.inotify_add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p, ctypes.c_uint32]
+    libc.inotify_rm_watch.argtypes = [ctypes.c_int, ctypes.c_int]
+    return libc
+
+
+def walk_dirs(root):
+    """Lists every directory below a root, skipping the svn admin folders"""
+    for folder, subdirs, files in os.walk(root):
+        if ADMIN_DIR in subdirs:
+            subdirs.remove(ADMIN_DIR)
+        yield folder
+
+
+class InotifyWatcher(threading.Thread):
+    """Watches working copies with inotify"""
+
+    def __init__(self, libc, on_change, fallback):
+        """Initializes the InotifyWatcher"""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.libc = libc
+        self.on_change = on_change
+        self.fallback = fallback
+        self.pending = []
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.watches = {}
+        self.roots = set()
+        self.lock = threading.Lock()
+        self.running = True
+
+    def add_watch(self, path):
+        """Adds a watch on a single directory, False if the watch limit has been reached"""
+        wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'), WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                return False
+            return True
+        with self.lock:
+            self.watches[wd] = path
+        return True
+
+    def add_tree(self, path):
+        """Watches every directory below a path, False if the watch limit has been reached"""
+        for folder in walk_dirs(path):
+            if not self.add_watch(folder):
+                util.debug('inotify watch limit reached while watching ' + path)
+                return False
+        return True
+
+    def watch(self, root):
+        """Starts watching a working copy, the watches are added by the watcher thread"""
+        with self.lock:
+            if root not in self.roots:
+                self.roots.add(root)
+                self.pending.append(root)
+        return True
+
+    def add_pending(self):
+        """Adds the watches of newly watched working copies, polling them if the watch limit is reached"""
+        with self.lock:
+            pending = self.pending
+            self.pending = []
+        for root in pending:
+            if not self.add_tree(root):
+                with self.lock:
+                    self.roots.discard(root)
+                self.fallback(root)
+
+    def handle(self, wd, mask, name):
+        """Handles a single inotify event"""
+        if mask & IN_Q_OVERFLOW:
+            for root in list(self.roots):
+                self.on_change(root, 'infinity')
+            return
+        with self.lock:
+            folder = self.watches.get(wd)
+            if mask & IN_IGNORED:
+                self.watches.pop(wd, None)
+        if folder is None or mask & IN_IGNORED:
+            return
+        if not name:
+            if mask & IN_DELETE_SELF:
+                self.on_change(folder, 'infinity')
+            return
+        if name == ADMIN_DIR:
+            return
+        path = os.path.join(folder, name)
+        if mask & IN_ISDIR and mask & NEW_DIR_MASK:
+            self.add_tree(path)
+            self.on_change(path, 'infinity')
+            return
+        self.on_change(path, 'file')
+
+    def run(self):
+        """Reads inotify events until stopped"""
+        while self.running:
+            self.add_pending()
+            try:
+                readable = select.select([self.fd], [], [], SELECT_TIMEOUT)[0]
+                if not readable:
+                    continue
+                data = os.read(self.fd, READ_SIZE)
+            except (OSError, select.error) as e:
+                if getattr(e, 'errno', None) in (errno.EAGAIN, errno.EINTR):
+                    continue
+                util.debug('inotify watcher stopped: ' + str(e))
+                break
+            offset = 0
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, cookie, length = EVENT_HEADER.unpack_from(data, offset)
+                offset = offset + EVENT_HEADER.size
+                name = data[offset:offset + length].rstrip(b'\0').decode('utf-8', 'replace')
+                offset = offset + length
+                self.handle(wd, mask, name)
+        os.close(self.fd)
+
+    def stop(self):
+        """Stops the watcher"""
+        self.running = False
+
+
+class PollingWatcher(threading.Thread):
+    """Watches working copies by polling the modification time of their directories"""
+
+    def __init__(self, on_change):
+        """Initializes the PollingWatcher"""
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.on_change = on_change
+        self.roots = {}
+        self.pending = []
+        self.lock = threading.Lock()
+        self.running = True
+
+    def snapshot(self, path):
+        """Gets the modification times of every directory below a path"""
+        times = {}
+        for folder in walk_dirs(path):
+            try:
+                times[folder] = os.stat(folder).st_mtime
+            except OSError:
+                continue
+        return times
+
+    def watch(self, root):
+        """Starts watching a working copy"""
+        with self.lock:
+            if root not in self.roots:
+                self.pending.append(root)
+        return True
+
+    def poll(self, times):
+        """Checks the directories of a working copy for changes"""
+        for folder in list(times.keys()):
+            if folder not in times:
+                continue
+            try:
+                mtime = os.stat(folder).st_mtime
+            except OSError:
+                for child in [f for f in times if f == folder or f.startswith(folder + os.sep)]:
+                    del times[child]
+                self.on_change(folder, 'infinity')
+                continue
+            if mtime == times[folder]:
+                continue
+            times[folder] = mtime
+            self.on_change(folder, 'immediates')
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                continue
+            for name in names:
+                path = os.path.join(folder, name)
+                if name != ADMIN_DIR and path not in times and os.path.isdir(path):
+                    times.update(self.snapshot(path))
+                    self.on_change(path, 'infinity')
+
+    def run(self):
+        """Polls the watched working copies until stopped"""
+        while self.running:
+            with self.lock:
+                pending = self.pending
+                self.pending = []
+            for root in pending:
+                self.roots[root] = self.snapshot(root)
+            for times in self.roots.values():
+                self.poll(times)
+            time.sleep(settings.get('fileWatcherPollInterval', default=2))
+
+    def stop(self):
+        """Stops the watcher"""
+        self.running = False
+
+
+class Watchers:
+    """Keeps the file system watchers shared by every working copy"""
+    inotify = None
+    polling = None
+    lock = threading.Lock()
+
+    def get_inotify(on_change):
+        """Gets the inotify watcher, None if inotify is not available"""
+        if Watchers.inotify is None:
+            libc = load_inotify()
+            if libc is None:
+                return None
+            fallback = lambda root: Watchers.get_polling(on_change).watch(root)
+            try:
+                Watchers.inotify = InotifyWatcher(libc, on_change, fallback)
+            except OSError as e:
+                util.debug('inotify is not available: ' + str(e))
+                return None
+            Watchers.inotify.start()
+        return Watchers.inotify
+
+    def get_polling(on_change):
+        """Gets the polling watcher"""
+        with Watchers.lock:
+            if Watchers.polling is not None:
+                return Watchers.polling
+            Watchers.polling = PollingWatcher(on_change)
+            Watchers.polling.start()
+        return Watchers.polling
+
+
+def watch(root, on_change):
+    """Starts watching a working copy, on_change(path, depth) is called for each change"""
+    mode = settings.get('fileWatcher', default='auto')
+    if mode is False or mode == 'none':
+        return False
+    if mode == 'auto':
+        with Watchers.lock:
+            inotify = Watchers.get_inotify(on_change)
+        if inotify is not None:
+            util.debug('Watching %s with inotify' % root)
+            return inotify.watch(root)
+    util.debug('Watching %s by polling' % root)
+    return Watchers.get_polling(on_change).watch(root)
+
+
+def is_notified(root):
+    """Checks if every change to a working copy is reported, polling only sees the directories change"""
+    with Watchers.lock:
+        inotify = Watchers.inotify
+    if inotify is None:
+        return False
+    with inotify.lock:
+        return root in inotify.roots
+
+
+def stop():
+    """Stops every watcher"""
+    with Watchers.lock:
+        if Watchers.inotify is not None:
+            Watchers.inotify.stop()
+            Watchers.inotify = None
+        if Watchers.polling is not None:
+            Watchers.polling.stop()
+            Watchers.polling = None
@@ -0,0 +1,235 @@
+import os
+import threading
+from urllib.parse import quote
+from . import util
+
+try:
+    import sqlite3
+except ImportError:
+    sqlite3 = None
+
+ADMIN_DIR = '.svn'
+WC_DB = 'wc.db'
+# wc.db formats written by Subversion 1.7 (29) through 1.14 (31)
+SUPPORTED_FORMATS = (29, 30, 31)
+VERSIONNED_PRESENCE = ('normal', 'incomplete', 'base-deleted')
+URL_SAFE = "/!$&'()*+,;=:@~"
+TIMEOUT = 0.1
+
+NODE_QUERY = (
+    'SELECT op_depth, presence, kind, revision, changed_revision, repos_id, repos_path,'
+    ' translated_size, last_mod_time, checksum'
+    ' FROM nodes WHERE wc_id = ? AND local_relpath = ? ORDER BY op_depth DESC'
+)
+BASE_QUERY = (
+    'SELECT repos_id, repos_path, revision FROM nodes'
+    ' WHERE wc_id = ? AND local_relpath = ? AND op_depth = 0'
+)
+ALL_NODES_QUERY = (
+    'SELECT local_relpath, op_depth, presence, kind, revision, translated_size, last_mod_time,'
+    ' checksum, properties FROM nodes WHERE wc_id = ? ORDER BY local_relpath, op_depth'
+)
+ACTUAL_QUERY = 'SELECT local_relpath, properties, conflict_data FROM actual_node WHERE wc_id = ?'
+LOCKS_QUERY = (
+    'SELECT nodes.local_relpath FROM nodes JOIN lock ON nodes.repos_id = lock.repos_id'
+    ' AND nodes.repos_path = lock.repos_relpath WHERE nodes.wc_id = ? AND nodes.op_depth = 0'
+)
+EXTERNALS_QUERY = (
+    "SELECT local_relpath FROM externals WHERE wc_id = ? AND kind = 'dir'"
+    " AND presence = 'normal' ORDER BY local_relpath"
+)
+REPOSITORY_QUERY = 'SELECT root FROM repository WHERE id = ?'
+WCROOT_QUERY = 'SELECT id FROM wcroot ORDER BY id LIMIT 1'
+
+
+def available():
+    """Checks if the sqlite3 module is available"""
+    return sqlite3 is not None
+
+
+def connect(path):
+    """Opens a read-only connection to a working copy database"""
+    location = path.replace(os.sep, '/')
+    if not location.startswith('/'):
+        location = '/' + location
+    uri = 'file:' + quote(location, '/:') + '?mode=ro'
+    try:
+        return sqlite3.connect(uri, timeout=TIMEOUT, uri=True, check_same_thread=False)
+    except TypeError:
+        # sqlite3 before Python 3.4 does not support URIs
+        return sqlite3.connect(path, timeout=TIMEOUT, check_same_thread=False)
+
+
+class Database:
+    """A read-only reader for the wc.db of a working copy"""
+    databases = {}
+    # the stamp of the wc.db that could not be read, it is tried again once the file changes
+    failures = {}
+    lock = threading.Lock()
+
+    def __init__(self, root, connection, wc_id, wc_format):
+        """Initializes a Database reader"""
+        self.root = root
+        self.connection = connection
+        self.wc_id = wc_id
+        self.format = wc_format
+        self.repositories = {}
+        self.lock = threading.Lock()
+
+    def get(root):
+        """Gets the reader for a working copy root, None if the database can not be read"""
+        if root is None or sqlite3 is None:
+            return None
+        with Database.lock:
+            if root in Database.databases:
+                return Database.databases[root]
+            stamp = Database.stamp(root)
+            if root in Database.failures and Database.failures[root] == stamp:
+                return None
+            db = Database.open(root)
+            if db is None:
+                Database.failures[root] = stamp
+            else:
+                Database.failures.pop(root, None)
+                Database.databases[root] = db
+            return db
+
+    def stamp(root):
+        """Gets the modification time and size of the database of a working copy root, None if it is missing"""
+        try:
+            found = os.stat(os.path.join(root, ADMIN_DIR, WC_DB))
+        except OSError:
+            return None
+        return (found.st_mtime, found.st_size)
+
+    def open(root):
+        """Opens the database of a working copy root if its format is recognised"""
+        path = os.path.join(root, ADMIN_DIR, WC_DB)
+        if not os.path.isfile(path):
+            return None
+        try:
+            connection = connect(path)
+            wc_format = connection.execute('PRAGMA user_version').fetchone()[0]
+            if wc_format not in SUPPORTED_FORMATS:
+                util.debug('Unrecognised working copy format %s in %s' % (wc_format, root))
+                connection.close()
+                return None
+            wc_id = connection.execute(WCROOT_QUERY).fetchone()[0]
+        except (sqlite3.Error, TypeError) as e:
+            util.debug('Unable to read %s: %s' % (path, str(e)))
+            return None
+        return Database(root, connection, wc_id, wc_format)
+
+    def close(root=None):
+        """Closes the reader for a working copy root, or all readers"""
+        with Database.lock:
+            roots = list(Database.databases.keys()) if root is None else [root]
+            if root is None:
+                Database.failures.clear()
+            else:
+                Database.failures.pop(root, None)
+            for r in roots:
+                db = Database.databases.pop(r, None)
+                if db is not None:
+                    db.connection.close()
+
+    def relpath(self, path):
+        """Gets the path relative to the working copy root, as stored in wc.db"""
+        rel = os.path.relpath(os.path.abspath(path), self.root)
+        if rel == os.curdir:
+            return ''
+        return rel.replace(os.sep, '/')
+
+    def repository(self, repos_id):
+        """Gets the root URL of a repository"""
+        if repos_id not in self.repositories:
+            row = self.connection.execute(REPOSITORY_QUERY, (repos_id,)).fetchone()
+            self.repositories[repos_id] = row[0] if row else None
+        return self.repositories[repos_id]
+
+    def base_url(self, relpath):
+        """Gets the URL and revision of the nearest node with a BASE location"""
+        suffix = []
+        while True:
+            row = self.connection.execute(BASE_QUERY, (self.wc_id, relpath)).fetchone()
+            if row is not None and row[0] is not None:
+                root = self.repository(row[0])
+                path = '/'.join([p for p in [row[1]] + list(reversed(suffix)) if p])
+                return (root + '/' + quote(path, URL_SAFE) if path else root), row[2]
+            if relpath == '':
+                return None, None
+            relpath, _, name = relpath.rpartition('/')
+            suffix.append(name)
+
+    def node(self, path):
+        """Gets the metadata of a node, None if it is not versionned"""
+        relpath = self.relpath(path)
+        if relpath.startswith('..'):
+            return None
+        with self.lock:
+            rows = self.connection.execute(NODE_QUERY, (self.wc_id, relpath)).fetchall()
+            if not rows or rows[0][1] not in VERSIONNED_PRESENCE:
+                return None
+            top = rows[0]
+            base = rows[-1] if rows[-1][0] == 0 else None
+            url, revision = self.base_url(relpath)
+        return {
+            'presence': top[1],
+            'kind': top[2],
+            'url': url,
+            'revision': base[3] if base is not None else revision,
+            'last_changed_rev': base[4] if base is not None else None,
+            'translated_size': top[7],
+            'last_mod_time': top[8],
+            'checksum': top[9]
+        }
+
+    def nodes(self):
+        """Gets every node row of the working copy, ordered by path and op_depth"""
+        with self.lock:
+            return self.connection.execute(ALL_NODES_QUERY, (self.wc_id,)).fetchall()
+
+    def actual_nodes(self):
+        """Gets the local property changes and conflicts of the working copy"""
+        with self.lock:
+            return self.connection.execute(ACTUAL_QUERY, (self.wc_id,)).fetchall()
+
+    def external_dirs(self):
+        """Gets the relative paths of the directory externals defined in the working copy"""
+        with self.lock:
+            return [row[0] for row in self.connection.execute(EXTERNALS_QUERY, (self.wc_id,))]
+
+    def locked_nodes(self):
+        """Gets the relative paths of the nodes locked by this working copy"""
+        with self.lock:
+            return [row[0] for row in self.connection.execute(LOCKS_QUERY, (self.wc_id,))]
+
+
+def get(root):
+    """Gets the wc.db reader for a working copy root"""
+    return Database.get(root)
+
+
+def lookup(root, path):
+    """Gets the metadata of a node, None if it is not versionned, False if wc.db can not answer"""
+    db = Database.get(root)
+    if db is None:
+        return False
+    try:
+        return db.node(path)
+    except sqlite3.Error as e:
+        util.debug('wc.db lookup failed for %s: %s' % (path, str(e)))
+        return False
+
+
+def external_dirs(root):
+    """Gets the absolute paths of the directory externals of a working copy, None if wc.db can not answer"""
+    db = Database.get(root)
+    if db is None:
+        return None
+    try:
+        relpaths = db.external_dirs()
+    except sqlite3.Error as e:
+        util.debug('wc.db externals lookup failed for %s: %s' % (root, str(e)))
+        return None
+    return [os.path.join(root, *relpath.split('/')) for relpath in relpaths]
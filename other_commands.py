@@ -1,6 +1,7 @@
 import sublime
 import sublime_plugin
-from .lib import thread, menu
+from functools import partial
+from .lib import benchmark, thread, menu, output, util
 
 
 class HypnoKillProcessesCommand(sublime_plugin.WindowCommand):
@@ -11,6 +12,44 @@ class HypnoKillProcessesCommand(sublime_plugin.WindowCommand):
         thread.terminate_all()
 
 
+class HypnoCancelProcessCommand(sublime_plugin.WindowCommand):
+    """A command that lists the running and queued nativeSVN processes to cancel one of them"""
+
+    def run(self):
+        """Runs the command"""
+        self.processes = thread.Process.running() + thread.Scheduler.queued()
+        if len(self.processes) == 0:
+            sublime.status_message('No active processes')
+            return
+        items = []
+        for process in self.processes:
+            state = 'Running' if process.started else 'Queued'
+            name = process.name + (' [#' + str(process.section.id) + ']' if process.section is not None else '')
+            items.append([name, '%s for %ds: %s' % (state, process.elapsed(), process.command)])
+        self.window.show_quick_panel(items, self.on_select)
+
+    def on_select(self, index):
+        """Cancels the selected process"""
+        if index < 0:
+            return
+        process = self.processes[index]
+        if not process.done:
+            process.terminate()
+            sublime.status_message('Cancelled: ' + process.name)
+        if process.section is not None and process.started:
+            # the end of the command is written with the next write to the view
+            sublime.set_timeout(partial(output.show_command, process.section.id, process.section.channel.window), output.FLUSH_INTERVAL * 2)
+
+
+class HypnoBenchmarkStatusCommand(sublime_plugin.WindowCommand):
+    """A command that times the local status engine against svn status on the working copies of the project"""
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        files = util.get_files(paths, group, index)
+        sublime.set_timeout_async(partial(benchmark.run, files, self.window), 0)
+
+
 class HypnoResetSideBarCommand(sublime_plugin.WindowCommand):
     """A command that resets the side bar to the default"""
 
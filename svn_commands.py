@@ -2,21 +2,19 @@ import sublime
 import sublime_plugin
 import os
 import os.path
-import re
 import subprocess
-import time
-from .lib import util, thread, settings, output, panels
+from functools import partial
+from .lib import util, backend, command, settings, output, panels, status, info, visibility, indicator, externals, fanout
 
-LOG_PARSE = r'-{72}[\r\n]+r(\d+) \| ([^|]+) \| ([^|]+) \| [^\n\r]+[\n\r]+(.+)'
-STATUS_PARSE = r'(^[A-W\?\!\ >]+?) +(\+ +)?(.*)'
-INFO_PARSE_REVISION = r'Revision: (\d+)'
-INFO_PARSE_LAST_CHANGE = r'Last Changed Rev: (\d+)'
-INFO_PARSE_URL = r'URL: ([^\n]*)'
+# commands whose externals are run as working copies of their own, svn update must handle the externals itself
+SPLIT_EXTERNALS = [
+    'cleanup',
+    'status'
+]
 
 
 class HypnoSvnCommand(sublime_plugin.WindowCommand):
     """Base command for svn commands"""
-    recent_files = []
     svn_tests = [
         'versionned',
         'changed'
@@ -35,46 +33,74 @@ class HypnoSvnCommand(sublime_plugin.WindowCommand):
         """Does nothing, just a placeholder for things I don't handle"""
         return
 
-    def get_svn_path(self):
-        """Gets the command to run for native SVN"""
-        svn_path = settings.get_native('svnPath', False)
-        if svn_path == False:
-            return 'svn '
+    def run_command(self, args, files=None, log=True, async=True, on_complete=None):
+        """Starts svn for a command that is not part of the backends, from its arguments"""
+        write = args[0] in command.WRITE_SUBCOMMANDS
+        if write:
+            on_complete = partial(self.on_write_complete, files, on_complete)
+        return backend.Cli().run(self.svn_name, args, files, log, async, on_complete, write=write)
+
+    def run_operation(self, operation, files=None, log=True, async=True, on_complete=None, **options):
+        """Runs an operation of the backend chosen in settings"""
+        if operation in command.WRITE_SUBCOMMANDS:
+            on_complete = partial(self.on_write_complete, files, on_complete)
+        return getattr(backend.get(), operation)(self.svn_name, files, log, async, on_complete, **options)
+
+    def on_write_complete(self, files, on_complete, process):
+        """Marks the files changed by a command as dirty in the status index"""
+        status.mark_dirty(files or [], 'infinity', own=True)
+        if on_complete is not None:
+            on_complete(process)
+
+    def run_parallel_command(self, operation, files, **options):
+        """Runs a command in parallel on each working copy root of the files, and on each svn:externals working copy below them for some commands"""
+        on_complete = None
+        if operation in command.WRITE_SUBCOMMANDS:
+            on_complete = partial(self.on_externals_write_complete, files)
+        if hasattr(backend.Backend, operation):
+            run_single = partial(self.run_operation, operation, files, **options)
         else:
-            return svn_path + ' '
+            run_single = partial(self.run_command, [operation], files)
+        split = operation in SPLIT_EXTERNALS
+        fanout.fan_out(self.svn_name, partial(self.run_group, operation, options, split), files, run_single, on_complete, split)
 
-    def run_command(self, cmd, files=None, log=True, async=True, on_complete=None):
-        """Starts a process for a native command"""
-        return thread.Process(self.svn_name, self.get_svn_path() + cmd, files, log, async, on_complete)
+    def run_group(self, operation, options, split, name, root, paths):
+        """Runs a command on the paths of a single working copy, leaving its externals out if they are run separately, and returns the completed process"""
+        if hasattr(backend.Backend, operation):
+            return getattr(backend.get(), operation)(name, paths, False, False, ignore_externals=split, **options)
+        # cleanup leaves the externals out by default
+        return backend.Cli().run(name, [operation], paths, False, False, write=operation in command.WRITE_SUBCOMMANDS)
+
+    def on_externals_write_complete(self, files, processes):
+        """Marks the files and their externals changed by a command as dirty in the status index"""
+        status.mark_dirty(externals.expand(files, False), 'infinity', own=True)
 
     def run_tortoise(self, cmd, files):
         """Starts a process for a TortoiseSVN command"""
         if not util.use_tortoise():
             sublime.error_message('Tortoise command can not be run: ' + cmd)
             return
-        command = '"' + settings.get_tortoise_path() + '" /command:' + cmd + ' /path:"%s"' % util.tortoise_path(files)
-        util.debug(command)
-        return subprocess.Popen(command, stdout=subprocess.PIPE)
+        args = command.tortoise(cmd, files)
+        util.debug(command.quote(args))
+        return subprocess.Popen(args, stdout=subprocess.PIPE)
 
-    def test_versionned(self, result):
-        """Tests output to verify if a file is versionned"""
-        return re.search(INFO_PARSE_REVISION, result, re.M) is not None
+    def run_external(self, cmd, files):
+        """Starts an interactive tool, like a graphical diff, outside of the process queue since it stays open until the user closes it"""
+        args = command.split(cmd) + list(files or [])
+        util.debug(command.quote(args))
+        try:
+            return subprocess.Popen(args, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        except OSError as e:
+            sublime.error_message('Unable to run ' + args[0] + ': ' + str(e))
+            return None
 
     def is_versionned(self, files):
-        """Runs a native command to verify if a file is versionned"""
-        if len(files) == 0:
-            return False
-
-        for f in files:
-            p = self.run_command('info', [f], False, False)
-            if self.test_versionned(p.output() + p.error()) is True:
-                return True
-        return False
+        """Checks wc.db, or a batched svn info, to verify if a file is versionned"""
+        return info.is_versionned(files)
 
     def is_changed(self, files):
-        """Runs a status command to see if a file has been changed since last revision"""
-        p = self.run_command('status', files, False, False)
-        return bool(p.output())
+        """Checks the working copy status indexes, externals included, to see if a file has been changed since last revision"""
+        return status.is_changed(externals.expand(files))
 
     def is_unchanged(self, files):
         """Checks if a file is unchanged since last revision"""
@@ -88,27 +114,15 @@ class HypnoSvnCommand(sublime_plugin.WindowCommand):
 
     def is_file(self, files):
         """Checks if a file is actually a file"""
-        if self.is_single(files) and os.path.isfile(files[0]):
-            return True
-        return False
+        return status.is_file(files)
 
     def is_folder(self, files):
         """Checks if a file is actually a folder"""
-        if self.is_single(files) and not os.path.isfile(files[0]):
-            return True
-        return False
+        return status.is_folder(files)
 
     def test_all(self, files):
         """Gets the result of all of the tests"""
-        uid = "*".join(files)
-        for tests in HypnoSvnCommand.recent_files:
-            if time.time() - tests['timestamp'] > 1:
-                HypnoSvnCommand.recent_files.remove(tests)
-                continue
-            if uid == tests['uid']:
-                return tests
         tests = {
-            'uid': uid,
             'file': self.is_file(files),
             'folder': self.is_folder(files),
             'single': self.is_single(files),
@@ -116,51 +130,62 @@ class HypnoSvnCommand(sublime_plugin.WindowCommand):
             'tortoise': util.use_tortoise()
         }
         if not settings.get("disableSVNChecks", default=False):
-            tests['versionned'] = self.is_versionned(files)
-            tests['changed'] = self.is_changed(files)
+            tests.update(visibility.svn_tests(files, self.svn_test_results))
         tests['enabled'] = tests['native'] or tests['tortoise']
-        tests['timestamp'] = time.time()
-        HypnoSvnCommand.recent_files.append(tests)
         return tests
 
+    def svn_test_results(self, files):
+        """Gets the result of the tests that need svn"""
+        return {
+            'versionned': self.is_versionned(files),
+            'changed': self.is_changed(files)
+        }
+
     def on_complete_select(self, values):
         """Handles completion of the MultiSelect"""
         self.files = values
 
-    def parse_changes(self, raw):
-        """Parses the output of a status command for use in a MultiSelect"""
-        matches = re.findall(STATUS_PARSE, raw, re.M)
-        if len(matches) < 1:
+    def list_changes(self, changes):
+        """Builds the MultiSelect items from the changes found by the local status engine"""
+        if len(changes) < 1:
             sublime.status_message('No changes')
             return False
         items = []
-        for change, modifier, path in matches:
-            inSVN = self.is_versionned([path])
+        for change, path in changes:
             item = {
                 'label': path,
                 'value': path,
-                'selected': inSVN
+                'selected': change != 'unversioned'
             }
             items.append(item)
         self.items = items
         return True
 
     def on_changes_available(self, process):
-        """Shows the list of changes to the user"""
-        output = process.output()
-        if not self.parse_changes(output):
+        """Shows the list of changes found by the backend to the user"""
+        entries = process.result or {}
+        changes = [(entries[key]['item'], entries[key]['path']) for key in sorted(entries.keys()) if status.is_entry_changed(entries[key])]
+        if not self.list_changes(changes):
+            return
+        panels.MultiSelect(self.items, self.on_complete_select, show_select_all=True)
+
+    def select_local_changes(self):
+        """Gets the committable changes from the local status engine, falls back to the backend"""
+        changes = status.changes(self.files)
+        if changes is None:
+            backend.get().status('Log', self.files, False, True, self.on_changes_available, structured=True)
+            return
+        if not self.list_changes(changes):
             return
         panels.MultiSelect(self.items, self.on_complete_select, show_select_all=True)
 
     def select_changes(self):
         """Gets the committable changes"""
-        thread.Process('Log', self.get_svn_path() + 'status', self.files, False, True, self.on_changes_available)
+        sublime.set_timeout_async(self.select_local_changes, 0)
 
     def get_url(self, file):
         """Gets the svn url for a file"""
-        p = self.run_command('info', [file], False, False)
-        m = re.search(INFO_PARSE_URL, p.output(), re.M)
-        return m.group(1)
+        return info.get_url(file)
 
     def run(self, cmd="", paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -168,7 +193,7 @@ class HypnoSvnCommand(sublime_plugin.WindowCommand):
             return
         files = util.get_files(paths, group, index)
         self.svn_name = cmd.upper()
-        self.run_command(cmd, files)
+        self.run_command(command.split(cmd), files)
 
     def is_visible(self, paths=None, group=-1, index=-1):
         """Checks if the command should be visible"""
@@ -178,6 +203,8 @@ class HypnoSvnCommand(sublime_plugin.WindowCommand):
         for key in self.tests:
             if svn_checks_off and key in HypnoSvnCommand.svn_tests:
                 continue
+            if key not in tests:
+                continue
             if tests[key] != self.tests[key]:
                 util.debug(self.svn_name + " is not visible because a test failed (%s)" % str(key))
                 return False
@@ -202,7 +229,7 @@ class HypnoSvnCommitCommand(HypnoSvnCommand):
 
     def commit(self):
         """Runs the native commit command"""
-        self.run_command('commit -m "' + util.escape_quotes(self.message) + '"', self.files)
+        self.run_operation('commit', self.files, message=self.message)
 
     def verify(self):
         """Checks with the user if the commit is valid"""
@@ -264,7 +291,7 @@ class HypnoSvnUpdateRevisionCommand(HypnoSvnCommand):
     def on_done_input(self, value):
         """Handles the result of the input panel"""
         self.svn_name = 'Update to revision (%s)' % value
-        self.run_command('update -r %s' % value, self.files)
+        self.run_operation('update', self.files, revision=value)
 
     def on_select(self, index):
         """Handles the result of the quickpanel"""
@@ -275,11 +302,10 @@ class HypnoSvnUpdateRevisionCommand(HypnoSvnCommand):
             self.get_revisions(self.number)
         revision = self.revisions[index]
         self.svn_name = 'Update to revision (%s)' % revision
-        self.run_command('update -r %s' % revision, self.files)
+        self.run_operation('update', self.files, revision=revision)
 
-    def parse_logs(self, raw):
-        """Parses the logs"""
-        matches = re.findall(LOG_PARSE, raw, re.M)
+    def parse_logs(self, matches):
+        """Builds the quick panel items from the (revision, author, date, message) of the logs"""
         revisions = []
         logs = []
         show_more = len(matches) >= self.number
@@ -295,15 +321,16 @@ class HypnoSvnUpdateRevisionCommand(HypnoSvnCommand):
 
     def on_logs_available(self, process):
         """Handles the logs being available"""
-        output = process.output()
-        self.parse_logs(output)
+        self.parse_logs(process.result or [])
+        if len(self.revisions) == 0:
+            return
         util.debug('found revisions:' + self.revisions[0] + '-' + self.revisions[-1])
         if len(self.logs) > 0:
             sublime.active_window().show_quick_panel(self.logs, self.on_select)
 
     def get_revisions(self, revisions):
         """Runs a process to get log output"""
-        thread.Process('Log', self.get_svn_path() + 'log -r HEAD:1 -l ' + str(revisions), self.files, False, True, self.on_logs_available)
+        backend.get().log('Log', self.files, False, True, self.on_logs_available, limit=revisions, structured=True)
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -344,7 +371,7 @@ class HypnoSvnUpdateCommand(HypnoSvnCommand):
             return
         if not util.use_native():
             return
-        self.run_command('update', files)
+        self.run_parallel_command('update', files)
 
 
 class HypnoSvnLogCommand(HypnoSvnCommand):
@@ -370,9 +397,9 @@ class HypnoSvnLogCommand(HypnoSvnCommand):
             return
         revisions = settings.get_native('logHistorySize', 20)
         if isinstance(revisions, int) and revisions > 0:
-            self.run_command('log -v -l %s' % revisions, files)
+            self.run_operation('log', files, limit=revisions, verbose=True)
         else:
-            self.run_command('log -v', files)
+            self.run_operation('log', files, verbose=True)
 
 
 class HypnoSvnLogNumberCommand(HypnoSvnCommand):
@@ -397,9 +424,8 @@ class HypnoSvnLogNumberCommand(HypnoSvnCommand):
             return
         if revisions < 1:
             return
-        revisions = str(revisions)
-        self.svn_name = 'Log (' + revisions + ')'
-        self.run_command('log -v -l %s' % revisions, self.files)
+        self.svn_name = 'Log (' + str(revisions) + ')'
+        self.run_operation('log', self.files, limit=revisions, verbose=True)
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -433,7 +459,92 @@ class HypnoSvnStatusCommand(HypnoSvnCommand):
             return
         if not util.use_native():
             return
-        self.run_command('status', files)
+        self.run_parallel_command('status', files)
+
+
+class HypnoSvnChangedFilesCommand(HypnoSvnCommand):
+    """A command that opens a changed file picked from the cached status of the working copies"""
+
+    def __init__(self, window):
+        """Initialize the command object"""
+        super().__init__(window)
+        self.svn_name = 'Go to Changed File'
+        self.tests = {
+            'native': True
+        }
+        self.files = None
+        self.changes = []
+        self.highlighted = None
+        self.generation = 0
+
+    def label(self, change, path):
+        """Builds the quick panel item for a change"""
+        for folder in self.files:
+            if status.is_child(status.normalize(path), status.normalize(folder)):
+                name = os.path.join(os.path.basename(folder), os.path.relpath(path, folder))
+                break
+        else:
+            name = path
+        return [name, indicator.LABELS.get(change, change)]
+
+    def show(self, changes, outdated=False):
+        """Shows the changes in the quick panel, keeping the highlighted file if it is still listed"""
+        self.generation = self.generation + 1
+        self.changes = sorted(changes, key=lambda change: change[1])
+        paths = [path for change, path in self.changes]
+        selected = paths.index(self.highlighted) if self.highlighted in paths else 0
+        if len(self.changes) > 0:
+            items = [self.label(change, path) for change, path in self.changes]
+        elif outdated:
+            items = [['No changes known yet', 'Checking for modifications...']]
+        else:
+            items = [['No changes', 'The working copies have no modifications']]
+        self.window.show_quick_panel(
+            items,
+            partial(self.on_select, self.generation),
+            sublime.MONOSPACE_FONT,
+            selected,
+            partial(self.on_highlight, self.generation)
+        )
+
+    def on_highlight(self, generation, index):
+        """Remembers the highlighted file"""
+        if generation == self.generation and 0 <= index < len(self.changes):
+            self.highlighted = self.changes[index][1]
+
+    def on_select(self, generation, index):
+        """Opens the selected file"""
+        if generation != self.generation:
+            return
+        self.generation = self.generation + 1
+        if index < 0 or index >= len(self.changes):
+            return
+        change, path = self.changes[index]
+        if not os.path.isfile(path):
+            sublime.status_message('Can not open ' + path + ' (' + change + ')')
+            return
+        self.window.open_file(path)
+
+    def refresh(self, generation):
+        """Brings the status up to date and updates the quick panel if it is still open"""
+        files = externals.expand(self.files)
+        for f in files:
+            status.WorkingCopy.get(f)
+        changes, outdated = status.cached_changes(files)
+        if generation != self.generation:
+            return
+        if len(changes) == 0 or sorted(changes, key=lambda change: change[1]) != self.changes:
+            sublime.set_timeout(partial(self.show, changes, outdated), 0)
+
+    def run(self, paths=None, group=-1, index=-1):
+        """Runs the command"""
+        util.debug(self.svn_name)
+        self.files = util.get_files(paths, group, index, 'project')
+        self.highlighted = None
+        changes, outdated = status.cached_changes(externals.expand(self.files, False))
+        self.show(changes, outdated)
+        if outdated:
+            sublime.set_timeout_async(partial(self.refresh, self.generation), 0)
 
 
 class HypnoSvnAddCommand(HypnoSvnCommand):
@@ -456,7 +567,7 @@ class HypnoSvnAddCommand(HypnoSvnCommand):
             return
         if not util.use_native():
             return
-        self.run_command('add', files)
+        self.run_command(['add'], files)
 
 
 class HypnoSvnDeleteCommand(HypnoSvnCommand):
@@ -480,7 +591,7 @@ class HypnoSvnDeleteCommand(HypnoSvnCommand):
             return
         if not util.use_native():
             return
-        self.run_command('delete', files)
+        self.run_command(['delete'], files)
 
 
 class HypnoSvnRevertAllCommand(HypnoSvnCommand):
@@ -500,7 +611,7 @@ class HypnoSvnRevertAllCommand(HypnoSvnCommand):
         """Runs the command"""
         util.debug(self.svn_name)
         files = util.get_files(paths, group, index)
-        self.run_command('revert -R', files)
+        self.run_command(['revert', '-R'], files)
 
     def is_visible(self, paths=None, group=-1, index=-1):
         if settings.get_native('alwaysEnableRevertAll', False):
@@ -525,7 +636,7 @@ class HypnoSvnRevertCommand(HypnoSvnCommand):
 
     def revert(self):
         """Runs the revert command on the sepcified files."""
-        self.run_command('revert', self.files)
+        self.run_command(['revert'], self.files)
 
     def on_complete_select(self, values):
         """Handles completion of the MultiSelect"""
@@ -569,7 +680,8 @@ class HypnoSvnCleanupCommand(HypnoSvnCommand):
             return
         if not util.use_native():
             return
-        self.run_command('cleanup', files)
+        # cleanup does not descend into externals unless asked to
+        self.run_parallel_command('cleanup', files)
 
 
 class HypnoSvnLockCommand(HypnoSvnCommand):
@@ -593,7 +705,7 @@ class HypnoSvnLockCommand(HypnoSvnCommand):
             return
         if not util.use_native():
             return
-        self.run_command('lock', files)
+        self.run_command(['lock'], files)
 
 
 class HypnoSvnStealLockCommand(HypnoSvnCommand):
@@ -614,7 +726,7 @@ class HypnoSvnStealLockCommand(HypnoSvnCommand):
         if not util.use_native():
             return
         files = util.get_files(paths, group, index)
-        self.run_command('lock --force', files)
+        self.run_command(['lock', '--force'], files)
 
 
 class HypnoSvnUnlockCommand(HypnoSvnCommand):
@@ -638,7 +750,7 @@ class HypnoSvnUnlockCommand(HypnoSvnCommand):
             return
         if not util.use_native():
             return
-        self.run_command('unlock', files)
+        self.run_command(['unlock'], files)
 
 
 class HypnoSvnDiffCommand(HypnoSvnCommand):
@@ -664,17 +776,17 @@ class HypnoSvnDiffCommand(HypnoSvnCommand):
             return
         if not util.use_native():
             return
-        command = settings.get_native('diffCommand', False)
-        if command is not False:
-            thread.Process(self.svn_name, command, files, log=False, async=True, interactive=True)
+        diff_command = settings.get_native('diffCommand', False)
+        if diff_command is not False:
+            self.run_external(diff_command, files)
         else:
-            self.run_command('diff', files)
+            self.run_operation('diff', files)
 
     def is_visible(self, paths=None, group=-1, index=-1):
-        command = False
+        diff_command = False
         if not util.prefer_tortoise('diff'):
-            command = settings.get_native('diffCommand', False)
-        if command is not False:
+            diff_command = settings.get_native('diffCommand', False)
+        if diff_command is not False:
             tests = self.tests
             self.tests = {
                 'versionned': True,
@@ -682,7 +794,7 @@ class HypnoSvnDiffCommand(HypnoSvnCommand):
                 'changed': True
             }
         value = super().is_visible(paths, group, index)
-        if command is not False:
+        if diff_command is not False:
             self.tests = tests
         return value
 
@@ -705,16 +817,18 @@ class HypnoSvnDiffPreviousCommand(HypnoSvnCommand):
         """Runs the command"""
         util.debug(self.svn_name)
         files = util.get_files(paths, group, index)
-        p = self.run_command('info', files, False, False)
-        output = p.output()
-        current = re.search(INFO_PARSE_REVISION, output).group(1)
-        last = str(int(re.search(INFO_PARSE_LAST_CHANGE, output).group(1)) - 1)
+        details = info.get_info(files[0])
+        if details is None or details['last_changed_rev'] is None:
+            sublime.status_message('No previous revision')
+            return
+        current = str(details['revision'])
+        last = str(details['last_changed_rev'] - 1)
         if util.prefer_tortoise('diff'):
             self.run_tortoise('diff /startrev:' + last + ' /endrev:' + current, files)
             return
         if not util.use_native():
             return
-        self.run_command('diff -r ' + last + ':' + current, files)
+        self.run_operation('diff', files, revision=last + ':' + current)
 
 
 class HypnoSvnRenameCommand(HypnoSvnCommand):
@@ -734,7 +848,7 @@ class HypnoSvnRenameCommand(HypnoSvnCommand):
         """Handles completion of an input panel"""
         src = os.path.join(self.head, self.tail)
         dest = os.path.join(self.head, value)
-        self.run_command('rename --parents', [src, dest])
+        self.run_command(['rename', '--parents'], [src, dest])
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -764,7 +878,7 @@ class HypnoSvnMoveCommand(HypnoSvnCommand):
 
     def on_done_input(self, value):
         """Handles completion of an input panel"""
-        self.run_command('mv --parents', [self.src, value])
+        self.run_command(['mv', '--parents'], [self.src, value])
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -793,7 +907,7 @@ class HypnoSvnBlameCommand(HypnoSvnCommand):
         if util.prefer_tortoise('blame'):
             self.run_tortoise('blame', files)
             return
-        self.run_command('blame', files)
+        self.run_operation('blame', files)
 
 
 class HypnoSvnConflictEditorCommand(HypnoSvnCommand):
@@ -838,7 +952,7 @@ class HypnoSvnResolveCommand(HypnoSvnCommand):
 
     def on_select(self, index):
         """Handles which option for resolution"""
-        self.run_command('resolve -R --accept ' + HypnoSvnResolveCommand.options[index], self.files)
+        self.run_command(['resolve', '-R', '--accept', HypnoSvnResolveCommand.options[index]], self.files)
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -865,7 +979,7 @@ class HypnoSvnCheckoutCommand(HypnoSvnCommand):
 
     def on_done_input(self, value):
         """Handles completion of the input panel"""
-        self.run_command('checkout', [value, self.files[0]])
+        self.run_command(['checkout'], [value, self.files[0]])
 
     def run(self, paths=None, group=-1, index=-1):
         """Runs the command"""
@@ -2,10 +2,11 @@ import sublime
 import sublime_plugin
 import os
 import re
-from .lib import output
+from .lib import output, transcript
 
 UNIX_PATH = r"/[^\n'\"]*"
 NT_PATH = r"[A-Za-z]:\\[^\n'\"]*"
+HISTORY_NAME = 'SVN Output History'
 
 
 class HypnoViewMessageCommand(sublime_plugin.TextCommand):
@@ -13,10 +14,12 @@ class HypnoViewMessageCommand(sublime_plugin.TextCommand):
 
     def run(self, edit, message=""):
         """Runs the command"""
+        start = self.view.size()
         self.view.set_read_only(False)
-        self.view.insert(edit, self.view.size(), message + '\n')
+        self.view.insert(edit, start, message + '\n')
         self.view.set_read_only(True)
-        output.highlight_conflicts()
+        output.mark_sections(self.view, message, start)
+        output.highlight_conflicts(self.view, message, start)
 
 
 class HypnoViewClearCommand(sublime_plugin.TextCommand):
@@ -27,10 +30,60 @@ class HypnoViewClearCommand(sublime_plugin.TextCommand):
         self.view.set_read_only(False)
         self.view.erase(edit, sublime.Region(0, self.view.size()))
         self.view.set_read_only(True)
+        output.forget_sections(self.view)
+        output.forget_conflicts(self.view)
 
     def is_visible(self, edit=None):
         """Checks if the view should be visible"""
-        return output.SvnView.get_existing() == self.view
+        return output.SvnView.get_existing(self.view.window()) == self.view
+
+
+class HypnoViewTrimCommand(sublime_plugin.TextCommand):
+    """A command that removes the oldest content from a view, leaving a marker in its place"""
+
+    def run(self, edit, size=0, start=0, marker=""):
+        """Runs the command"""
+        self.view.set_read_only(False)
+        self.view.erase(edit, sublime.Region(start, size))
+        self.view.insert(edit, start, marker)
+        self.view.set_read_only(True)
+        output.shift_sections(self.view, size, start, len(marker))
+        output.shift_conflicts(self.view, size, start, len(marker))
+
+
+class HypnoOutputHistoryCommand(sublime_plugin.WindowCommand):
+    """A command that opens a command from the output transcripts"""
+
+    def run(self):
+        """Runs the command"""
+        self.sections = []
+        for path in transcript.paths():
+            for start, end, title in reversed(transcript.sections(path)):
+                self.sections.append((path, start, end, title))
+        if not self.sections:
+            sublime.status_message('No SVN output history')
+            return
+        items = [[title, os.path.basename(path) + ', ' + str(end - start) + ' bytes'] for path, start, end, title in self.sections]
+        self.window.show_quick_panel(items, self.on_select)
+
+    def on_select(self, index):
+        """Opens the selected command in a view"""
+        if index < 0:
+            return
+        path, start, end, title = self.sections[index]
+        text = transcript.read(path, start, end)
+        if text is None:
+            return
+        view = self.window.new_file()
+        view.set_scratch(True)
+        view.set_name(HISTORY_NAME)
+        view.set_syntax_file(output.SYNTAX)
+        view.run_command(
+            'hypno_view_message',
+            {
+                "message": text.rstrip('\n')
+            }
+        )
 
 
 class HypnoOutputClearCommand(sublime_plugin.WindowCommand):
@@ -38,13 +91,13 @@ class HypnoOutputClearCommand(sublime_plugin.WindowCommand):
 
     def run(self, group=-1, index=-1):
         """Runs the command"""
-        output.clear()
+        output.clear(self.window)
 
     def is_visible(self, group=-1, index=-1):
         """Checks if the view should be visible"""
         if group >= 0 and index >= 0:
-            view = sublime.active_window().views_in_group(group)[index]
-            return output.SvnView.get_existing() == view
+            view = self.window.views_in_group(group)[index]
+            return output.SvnView.get_existing(self.window) == view
         return True
 
 
@@ -75,7 +128,7 @@ class HypnoOutputOpenFileCommand(sublime_plugin.TextCommand):
 
     def is_visible(self, edit=None):
         """Checks if the view should be visible"""
-        if output.SvnView.get_existing() != self.view:
+        if output.SvnView.get_existing(self.view.window()) != self.view:
             return False
         regions = self.view.sel()
         for region in regions:
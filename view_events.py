@@ -1,5 +1,8 @@
+import sublime
 import sublime_plugin
-from .lib import output
+import os
+from functools import partial
+from .lib import indicator, locks, output, settings
 
 
 class SvnViewEvents(sublime_plugin.EventListener):
@@ -7,4 +10,65 @@ class SvnViewEvents(sublime_plugin.EventListener):
 
     def on_close(self, view):
         """Stop using the view if it has been closed"""
-        output.SvnView.close(view)
\ No newline at end of file
+        output.SvnView.close(view)
+
+
+class SvnStatusEvents(sublime_plugin.EventListener):
+    """Keeps the SVN status of the files in the status bar"""
+
+    def on_post_save_async(self, view):
+        """Marks a saved file as changed and refreshes its status"""
+        indicator.update(view, saved=True)
+
+    def on_activated_async(self, view):
+        """Refreshes the status of a file when its view is focused"""
+        indicator.update(view)
+
+
+class SvnLockEvents(sublime_plugin.EventListener):
+    """Offers to lock files that need a lock as soon as they are modified"""
+    checked = set()
+
+    def on_modified_async(self, view):
+        """Checks the lock of a file on the first modification of its view"""
+        if view.id() in SvnLockEvents.checked:
+            return
+        SvnLockEvents.checked.add(view.id())
+        file_name = view.file_name()
+        if file_name is None or not settings.get('needsLockCheck', default=True):
+            return
+        locks.check(file_name, partial(self.on_lock_state, view.window(), file_name))
+
+    def on_load_async(self, view):
+        """Fills the lock map in the background so that the first modification is answered from it"""
+        file_name = view.file_name()
+        if file_name is not None and settings.get('needsLockCheck', default=True):
+            locks.check(file_name, self.nothing)
+
+    def nothing(self, state):
+        """Ignores a lock state"""
+        return
+
+    def on_lock_state(self, window, file_name, state):
+        """Offers to lock the file, or tells who holds the lock"""
+        if state is None or not state['needs_lock'] or state['own']:
+            return
+        if state['owner'] is not None:
+            sublime.set_timeout(partial(
+                sublime.message_dialog,
+                os.path.basename(file_name) + ' needs a lock and is locked by ' + state['owner']
+            ), 0)
+            return
+        sublime.set_timeout(partial(self.offer_lock, window, file_name), 0)
+
+    def offer_lock(self, window, file_name):
+        """Asks the user to lock a file"""
+        if window is None:
+            return
+        message = os.path.basename(file_name) + ' needs a lock (svn:needs-lock) before it can be saved.\n\nLock it now?'
+        if sublime.ok_cancel_dialog(message, 'Lock'):
+            window.run_command('hypno_svn_lock', {'paths': [file_name]})
+
+    def on_close(self, view):
+        """Checks the lock again if the file is opened again"""
+        SvnLockEvents.checked.discard(view.id())